@@ -0,0 +1,429 @@
+"""
+بنچمارک ربات در برابر سرور جعلی Bot API (بدون اینترنت، مناسب CI)
+
+سرور جعلی روی 127.0.0.1 اجرا می‌شود و تأخیر، خطای 429 (retry_after) و خطای ارسال را
+شبیه‌سازی می‌کند. دیتابیس موقت با کاربران ساختگی پر می‌شود و سناریوها روی همان
+Application واقعی ربات اجرا می‌شوند.
+
+مثال:
+    python benchmark.py --users 10000 --rate 1000 --latency 0.02 --rate-429 0.01
+    python benchmark.py --scenarios broadcast,export --users 100000
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+BENCH_TOKEN = '123456:BENCHMARK'
+BENCH_ADMIN_ID = 1
+FIRST_USER_ID = 10_000_000
+
+SCENARIOS = ('broadcast', 'registration', 'callbacks', 'export')
+
+# متدهایی که سرور جعلی پاسخ می‌دهد
+API_METHODS = (
+    'getMe', 'sendMessage', 'editMessageText', 'sendPhoto', 'sendDocument', 'sendMediaGroup',
+    'sendChatAction', 'answerCallbackQuery', 'setWebhook', 'deleteWebhook', 'getUpdates',
+)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss در لینوکس بر حسب کیلوبایت است
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --- سرور جعلی Bot API ---
+class FakeBotAPI:
+    """
+    پاسخ‌گوی متدهای Bot API با خطای قابل تنظیم
+
+    خطاها فقط روی fault_methods اعمال می‌شوند تا راه‌اندازی (getMe) همیشه موفق باشد.
+    زمان رسیدن هر درخواست به ازای متد ثبت می‌شود.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, error_rate=0.0, retry_after=1,
+                 fault_methods=('sendMessage',), seed=0):
+        from web import WebServer
+
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.fault_methods = set(fault_methods)
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.faults = Counter()
+        self.received = []
+        self.message_ids = itertools.count(1)
+        self.server = WebServer()
+        for method in API_METHODS:
+            self.server.route(f"/bot{BENCH_TOKEN}/{method}", methods=('GET', 'POST'))(self._handler(method))
+
+    async def start(self, port):
+        await self.server.start('127.0.0.1', port)
+
+    async def stop(self):
+        await self.server.stop()
+
+    def reset(self):
+        self.calls.clear()
+        self.faults.clear()
+        self.received.clear()
+
+    @staticmethod
+    def _params(request):
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[-1] for key, values in parse_qs(request.body.decode()).items()}
+        if content_type.startswith('multipart/form-data'):
+            match = re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', request.body)
+            return {'chat_id': match.group(1).decode()} if match else {}
+        if content_type.startswith('application/json'):
+            return request.json() or {}
+        return dict(request.query)
+
+    def _message(self, chat_id, **fields):
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+            **fields
+        }
+
+    def _handler(self, method):
+        from web import json_response
+
+        async def handle(request):
+            params = self._params(request)
+            self.calls[method] += 1
+            self.received.append((time.perf_counter(), method, params.get('chat_id')))
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+
+            if method in self.fault_methods:
+                draw = self.random.random()
+                if draw < self.rate_429:
+                    self.faults['429'] += 1
+                    return json_response({
+                        'ok': False, 'error_code': 429,
+                        'description': f"Too Many Requests: retry after {self.retry_after}",
+                        'parameters': {'retry_after': self.retry_after}
+                    }, 429)
+                if draw < self.rate_429 + self.error_rate:
+                    self.faults['403'] += 1
+                    return json_response({
+                        'ok': False, 'error_code': 403, 'description': "Forbidden: bot was blocked by the user"
+                    }, 403)
+
+            return json_response({'ok': True, 'result': self._result(method, params)})
+
+        return handle
+
+    def _result(self, method, params):
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(chat_id, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=[{'file_id': 'p', 'file_unique_id': 'p', 'width': 1, 'height': 1}])
+        if method == 'sendDocument':
+            return self._message(chat_id, document={'file_id': 'd', 'file_unique_id': 'd'})
+        if method == 'sendMediaGroup':
+            return [self._message(chat_id)]
+        if method == 'getUpdates':
+            return []
+        return True
+
+
+# --- ساخت آپدیت‌های ساختگی ---
+class UpdateFactory:
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+
+    def message(self, user_id, **fields):
+        return {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self.user(user_id),
+                **fields
+            }
+        }
+
+    def command(self, user_id, text):
+        command = text.split()[0]
+        return self.message(user_id, text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+    def callback(self, user_id, data):
+        return {
+            'update_id': next(self.update_ids),
+            'callback_query': {
+                'id': str(next(self.update_ids)),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self.message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '...'
+                }
+            }
+        }
+
+
+# --- پر کردن دیتابیس ---
+def seed_verified_users(db, count):
+    now = db._now()
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM verified_users')
+        conn.executemany(
+            'INSERT INTO verified_users (user_id, phone, full_name, nid, registration_date) VALUES (?, ?, ?, ?, ?)',
+            ((FIRST_USER_ID + i, f"+98912{i:07d}", f"کاربر {i}", f"{i:010d}", now) for i in range(count))
+        )
+
+
+def seed_pending(db, count, first_id):
+    now = db._now()
+    with db.transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO pending_verification (id, user_id, phone, full_name, nid, file_id, date, file_ids) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((f"bench-{i}", first_id + i, f"+98935{i:07d}", f"متقاضی {i}", f"{i:010d}", 'p', now, '["p"]')
+             for i in range(count))
+        )
+
+
+# --- سناریوها ---
+class Result:
+    def __init__(self, name, count, elapsed, latencies, api, faults):
+        self.name = name
+        self.count = count
+        self.elapsed = elapsed
+        self.latencies = latencies
+        self.api = api
+        self.faults = faults
+        self.rss = peak_rss_mb()
+
+    def report(self):
+        throughput = self.count / self.elapsed if self.elapsed else 0.0
+        lines = [
+            f"▶ {self.name}: {self.count} در {self.elapsed:.2f}s → {throughput:.1f}/s",
+            f"  تأخیر p50={percentile(self.latencies, 50) * 1000:.1f}ms "
+            f"p95={percentile(self.latencies, 95) * 1000:.1f}ms "
+            f"p99={percentile(self.latencies, 99) * 1000:.1f}ms",
+            f"  Bot API: " + ", ".join(f"{name}={count}" for name, count in self.api.most_common()),
+            f"  حافظه (peak RSS): {self.rss:.1f}MB",
+        ]
+        if self.faults:
+            lines.insert(3, "  خطاهای تزریق شده: " + ", ".join(f"{k}={v}" for k, v in self.faults.items()))
+        return "\n".join(lines)
+
+
+async def timed(coro, latencies):
+    started = time.perf_counter()
+    await coro
+    latencies.append(time.perf_counter() - started)
+
+
+async def scenario_broadcast(bot, app, api, args):
+    """ارسال همگانی از مسیر واقعی صف ارسال (run_broadcast_job)"""
+    from types import SimpleNamespace
+
+    seed_verified_users(bot.db, args.users)
+    await bot.load_recipients()
+    job_id = await bot.db.create_broadcast_job('message', {'text': 'پیام آزمایشی'}, bot.ADMIN_CHAT_ID, args.users)
+    api.reset()
+    started = time.perf_counter()
+    await bot.run_broadcast_job(SimpleNamespace(job=SimpleNamespace(data=job_id), bot=app.bot))
+    elapsed = time.perf_counter() - started
+    admin = str(bot.ADMIN_CHAT_ID)
+    latencies = [at - started for at, method, chat_id in api.received if method == 'sendMessage' and chat_id != admin]
+    job = await bot.db.get_broadcast_job(job_id)
+    return Result(f"broadcast ({job['success']} موفق، {job['failed']} ناموفق)", len(latencies), elapsed,
+                  latencies, Counter(api.calls), Counter(api.faults))
+
+
+async def scenario_registration(bot, app, api, args):
+    """موج ثبت‌نام: هر کاربر دکمه ثبت‌نام، شماره، نام و کد ملی و فیش را ارسال می‌کند"""
+    from telegram import Update
+    from receipts import RECEIPT_WINDOW
+
+    factory = UpdateFactory()
+    first_id = FIRST_USER_ID + args.users
+    count = args.registrations
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(user_id):
+        steps = (
+            factory.callback(user_id, 'register_signal'),
+            factory.message(user_id, contact={'phone_number': f"+98{user_id}", 'first_name': 'u', 'user_id': user_id}),
+            factory.message(user_id, text=f"کاربر {user_id} {user_id:010d}"),
+            factory.message(user_id, photo=[{'file_id': f"p{user_id}", 'file_unique_id': f"u{user_id}",
+                                            'width': 90, 'height': 90}]),
+        )
+        async with semaphore:
+            for data in steps:
+                await timed(app.process_update(Update.de_json(data, app.bot)), latencies)
+
+    api.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(register(first_id + i) for i in range(count)))
+    # منتظر ثبت دسته‌ای فیش‌ها پس از بازه انتظار
+    await asyncio.sleep(RECEIPT_WINDOW + 0.5)
+    while app.job_queue.jobs():
+        if not any(job.name.startswith('receipts:') for job in app.job_queue.jobs()):
+            break
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    return Result(f"registration ({count} کاربر)", len(latencies), elapsed, latencies,
+                  Counter(api.calls), Counter(api.faults))
+
+
+async def scenario_callbacks(bot, app, api, args):
+    """طوفان کلیک ادمین روی تایید/رد؛ هر دکمه دو بار (کلیک تکراری) زده می‌شود"""
+    from telegram import Update
+
+    factory = UpdateFactory()
+    first_id = FIRST_USER_ID + args.users + args.registrations
+    count = args.callbacks
+    seed_pending(bot.db, count, first_id)
+    updates = []
+    for i in range(count):
+        action = 'verify_payment' if i % 4 else 'reject_payment'
+        data = f"{action}:bench-{i}"
+        updates += [factory.callback(bot.ADMIN_CHAT_ID, data), factory.callback(bot.ADMIN_CHAT_ID, data)]
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def click(data):
+        async with semaphore:
+            await timed(app.process_update(Update.de_json(data, app.bot)), latencies)
+
+    api.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(click(data) for data in updates))
+    elapsed = time.perf_counter() - started
+    return Result(f"callbacks ({count} درخواست × ۲ کلیک)", len(latencies), elapsed, latencies,
+                  Counter(api.calls), Counter(api.faults))
+
+
+async def scenario_export(bot, app, api, args):
+    """خروجی کاربران در همه قالب‌ها"""
+    from telegram import Update
+    from export import EXPORT_FORMATS
+
+    factory = UpdateFactory()
+    latencies = []
+    api.reset()
+    started = time.perf_counter()
+    for fmt in sorted(set(EXPORT_FORMATS.values())):
+        update = Update.de_json(factory.command(bot.ADMIN_CHAT_ID, f"/export {fmt}"), app.bot)
+        await timed(app.process_update(update), latencies)
+    elapsed = time.perf_counter() - started
+    return Result(f"export ({len(latencies)} قالب، {args.users} کاربر)", len(latencies), elapsed, latencies,
+                  Counter(api.calls), Counter(api.faults))
+
+
+SCENARIO_FUNCTIONS = {
+    'broadcast': scenario_broadcast,
+    'registration': scenario_registration,
+    'callbacks': scenario_callbacks,
+    'export': scenario_export,
+}
+
+
+async def run(args):
+    import broadcast
+    import bot
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    bot.db.init_db()
+    if args.rate:
+        broadcast.limiter = broadcast.RateLimiter(args.rate)
+
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_429, args.error_rate, args.retry_after,
+                     args.fault_methods.split(','), args.seed)
+    await api.start(args.port)
+    app = bot.build_application()
+    await app.initialize()
+    await app.start()
+    results = []
+    try:
+        for name in args.scenarios.split(','):
+            result = await SCENARIO_FUNCTIONS[name.strip()](bot, app, api, args)
+            print(result.report(), flush=True)
+            results.append(result)
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await api.stop()
+        bot.db.close_all()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="بنچمارک ربات با سرور جعلی Bot API")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--users', type=int, default=1000, help="تعداد کاربران تایید شده ساختگی")
+    parser.add_argument('--registrations', type=int, default=200)
+    parser.add_argument('--callbacks', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=100, help="آپدیت‌های همزمان در سناریوهای آپدیت")
+    parser.add_argument('--rate', type=float, default=0, help="سقف ارسال در ثانیه (۰ = پیش‌فرض ربات)")
+    parser.add_argument('--latency', type=float, default=0.0, help="تأخیر پایه هر درخواست (ثانیه)")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help="احتمال پاسخ 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="احتمال پاسخ 403")
+    parser.add_argument('--fault-methods', default='sendMessage')
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="نمایش لاگ‌های ربات و httpx")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='zarzang-bench-')
+    # تنظیمات باید پیش از import ماژول‌های ربات انجام شود
+    os.environ['DB_NAME'] = os.path.join(workdir, 'bot_data.db')
+    os.environ['TOKEN'] = BENCH_TOKEN
+    os.environ['ADMIN_CHAT_ID'] = str(BENCH_ADMIN_ID)
+    os.environ['TELEGRAM_API_URL'] = f"http://127.0.0.1:{args.port}"
+    os.environ.pop('WEBHOOK_URL', None)
+    os.environ.pop('PRICE_FEED', None)
+    print(f"🧪 دیتابیس موقت: {os.environ['DB_NAME']}")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
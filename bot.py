@@ -1,23 +1,45 @@
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
-    KeyboardButton, ReplyKeyboardMarkup
+    KeyboardButton, ReplyKeyboardMarkup, InputMediaPhoto
 )
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
-    MessageHandler, filters, ContextTypes
+    MessageHandler, TypeHandler, filters, ContextTypes
 )
+from telegram.error import BadRequest, TelegramError
 import logging
 from datetime import datetime
+from functools import lru_cache
+import html
+import json
 import os
-import sqlite3
-import uuid
-import threading
-import time
-import requests
-from flask import Flask, Response
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
+import asyncio
+import hmac
+import secrets
+import signal
+from broadcast import fan_out, BroadcastStats
+import db
+from recipients import cache as recipient_cache
+from export import build_export, EXPORT_FORMATS
+from web import WebServer, Response, KeepAlive, json_response
+from health import monitor as health_monitor
+import metrics
+from persistence import SQLitePersistence
+from signals import (
+    create_signal, get_signal, get_open_signals, set_status as set_signal_status,
+    update_levels as update_signal_levels, content_hash
+)
+from sizing import to_decimal
+from profiles import PersonalizedSignal
+from coalesce import Coalescer
+from processor import OrderedUpdateProcessor
+import sharding
+from receipts import collector as receipt_collector, RECEIPT_WINDOW, MEDIA_GROUP_LIMIT
+from monitor import SignalMonitor, create_feed, normalize_symbol, ENTRY, TP, SL
+from state import (
+    Registration, StopLossInput, CapitalInput, RiskProfileInput, AdminBroadcastInput, SignalInput,
+    get_state, set_state, clear_state
+)
 
 # تنظیمات لاگ‌گیری
 logging.basicConfig(
@@ -29,283 +51,547 @@ logger = logging.getLogger(__name__)
 # تنظیمات اصلی
 TOKEN = os.environ.get('TOKEN', 'YOUR_BOT_TOKEN')
 ADMIN_CHAT_ID = int(os.environ.get('ADMIN_CHAT_ID', 86101721))
-DB_NAME = "bot_data.db"
 PORT = int(os.environ.get('PORT', 10000))
 
-# سیستم بیدار ماندن
-PING_URL = f"https://{os.environ.get('RENDER_EXTERNAL_HOSTNAME', 'your-app-name.onrender.com')}"
-PING_INTERVAL = 300
+# آدرس Bot API (اختیاری؛ برای سرور Bot API محلی یا سرور جعلی بنچمارک)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
 
-def keep_alive():
-    while True:
-        try:
-            logger.info(f"🔄 ارسال پینگ به {PING_URL}...")
-            response = requests.get(PING_URL)
-            logger.info(f"✅ پاسخ پینگ: {response.status_code}")
-        except Exception as e:
-            logger.error(f"❌ خطا در ارسال پینگ: {e}")
-        time.sleep(PING_INTERVAL)
+# حالت وب‌هوک (اختیاری): با تنظیم WEBHOOK_URL به جای long polling استفاده می‌شود
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# تعداد اتصال‌های همزمان به Bot API
+TELEGRAM_POOL_SIZE = 256
+
+# صف ارسال همگانی
+BROADCAST_CHUNK_SIZE = 200
+PROGRESS_INTERVAL = 3
+
+# تعداد کاربر در هر صفحه /list_users
+USERS_PAGE_SIZE = 10
+
+# تعداد درخواست در هر صفحه /pending
+PENDING_PAGE_SIZE = 8
+
+# فاصله بررسی هماهنگی کش گیرندگان با دیتابیس (ثانیه)
+RECIPIENT_CHECK_INTERVAL = 300
 
-def start_keep_alive():
-    thread = threading.Thread(target=keep_alive, daemon=True)
-    thread.start()
-    logger.info("📡 فعال‌سازی سیستم بیدار ماندن ربات...")
+# مدت نگهداری گزارش خطاهای تحویل (روز) و بازه پیش‌فرض /delivery_report
+DELIVERY_LOG_RETENTION_DAYS = int(os.environ.get('DELIVERY_LOG_RETENTION_DAYS', 30))
+DELIVERY_REPORT_DAYS = 7
+DELIVERY_STATUS_LABELS = {
+    'blocked': 'مسدود کرده',
+    'not_found': 'حساب حذف شده',
+    'rate_limited': 'محدودیت نرخ',
+    'network': 'خطای شبکه',
+    'other': 'سایر',
+}
+
+# پایش قیمت سیگنال‌ها (اختیاری): binance یا replay:<مسیر فایل>
+PRICE_FEED = os.environ.get('PRICE_FEED')
+
+# سیستم بیدار ماندن (فقط وقتی آدرس عمومی سرویس مشخص باشد)
+PING_HOST = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
+PING_URL = os.environ.get('PING_URL') or (f"https://{PING_HOST}" if PING_HOST else None)
+PING_INTERVAL = 300
 
 # سرور وب
-app = Flask(__name__)
+web_server = WebServer()
+keep_alive = KeepAlive(PING_URL, PING_INTERVAL) if PING_URL else None
+
+# برنامه تلگرام در حالت وب‌هوک
+webhook_application = None
+
+@web_server.route('/')
+async def home(request):
+    return Response("✅ ربات زرزنگ با موفقیت در حال اجراست!")
+
+@web_server.route('/health')
+async def health_check(request):
+    healthy, _, report = await health_monitor.check()
+    return json_response(report, 200 if healthy else 503)
+
+@web_server.route('/ready')
+async def ready_check(request):
+    _, ready, report = await health_monitor.check()
+    return json_response(report, 200 if ready else 503)
+
+loop_lag_gauge = metrics.registry.gauge('bot_event_loop_lag_seconds', 'Event loop lag')
+recipients_gauge = metrics.registry.gauge('bot_verified_recipients', 'Cached verified recipients')
+ping_gauge = metrics.registry.gauge('bot_keep_alive_latency_seconds', 'Last keep-alive ping latency')
+
+@web_server.route('/metrics')
+async def metrics_endpoint(request):
+    loop_lag_gauge.set(health_monitor.loop_lag)
+    if not shard_router:
+        recipients_gauge.set(len(recipient_cache))
+    if keep_alive and keep_alive.last_latency is not None:
+        ping_gauge.set(keep_alive.last_latency)
+    # در اجرای چندپروسه‌ای معیارهای هندلر، دیتابیس و Bot API در کارگرها ثبت می‌شوند
+    snapshots = shard_router.collect() if shard_router else ()
+    return Response(metrics.registry.render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@web_server.route(WEBHOOK_PATH, methods=('POST',))
+async def telegram_webhook(request):
+    if webhook_application is None:
+        return Response(status=404)
+
+    # هدرها latin-1 خوانده می‌شوند؛ مقایسه بایتی تا هدر غیر ASCII به جای خطا 403 بگیرد
+    token = request.headers.get('x-telegram-bot-api-secret-token', '')
+    if not hmac.compare_digest(token.encode('latin-1'), WEBHOOK_SECRET.encode()):
+        return Response(status=403)
 
-@app.route('/')
-def home():
-    return "✅ ربات زرزنگ با موفقیت در حال اجراست!"
+    try:
+        update = Update.de_json(request.json(), webhook_application.bot)
+    except Exception as e:
+        logger.error(f"Invalid webhook payload: {e}")
+        return Response(status=400)
 
-@app.route('/health')
-def health_check():
+    await webhook_application.update_queue.put(update)
     return Response(status=200)
 
-def run_web_server():
-    app.run(host='0.0.0.0', port=PORT)
-
-# --- توابع دیتابیس ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS verified_users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER UNIQUE,
-        phone TEXT,
-        full_name TEXT,
-        nid TEXT,
-        registration_date TEXT
-    )
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS pending_verification (
-        id TEXT PRIMARY KEY,
-        user_id INTEGER,
-        phone TEXT,
-        full_name TEXT,
-        nid TEXT,
-        file_id TEXT,
-        date TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_verified_user(user_data):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-    INSERT OR REPLACE INTO verified_users
-    (user_id, phone, full_name, nid, registration_date)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (
-        user_data['user_id'],
-        user_data['phone'],
-        user_data['full_name'],
-        user_data['nid'],
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ))
-    conn.commit()
-    conn.close()
-
-def save_pending_verification(user_data):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-    INSERT INTO pending_verification
-    (id, user_id, phone, full_name, nid, file_id, date)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        str(uuid.uuid4()),
-        user_data['user_id'],
-        user_data['phone'],
-        user_data['full_name'],
-        user_data['nid'],
-        user_data['file_id'],
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ))
-    conn.commit()
-    conn.close()
-
-def get_pending_verification(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM pending_verification WHERE user_id = ?', (user_id,))
-    result = cur.fetchone()
-    conn.close()
-    return result
-
-def remove_pending_verification(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('DELETE FROM pending_verification WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-def create_excel_file():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM verified_users")
-    users = cursor.fetchall()
-    conn.close()
+async def start_web_services():
+    await web_server.start('0.0.0.0', PORT)
+    if keep_alive:
+        keep_alive.start()
+
+async def stop_web_services():
+    if keep_alive:
+        await keep_alive.stop()
+    await web_server.stop()
+
+# --- کیبوردها و متن‌های ثابت ---
+# همه یک بار هنگام بارگذاری ماژول ساخته می‌شوند (اشیای تلگرام پس از ساخت تغییرناپذیرند)
+START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("تلگرام زرزنگ", url="https://t.me/ddingooa"),
+     InlineKeyboardButton("یوتیوب زرزنگ", url="https://www.youtube.com/zerzang")],
+    [InlineKeyboardButton("اینستاگرام زرزنگ", url="https://instagram.com/zerzang"),
+     InlineKeyboardButton("سایت زرزنگ", url="https://zerzang.com")],
+    [InlineKeyboardButton("ثبت نام سیگنال فیوچرز", callback_data="register_signal")],
+    [InlineKeyboardButton("پشتیبانی", callback_data="support")],
+    [InlineKeyboardButton("محاسبه حد ضرر", callback_data="calc_stop_loss")],
+    [InlineKeyboardButton("پروفایل ریسک من", callback_data="risk_profile")],
+    [InlineKeyboardButton("صرافی‌ها و بروکرهای ویژه", callback_data="exchanges_brokers")]
+])
+
+BACK_BUTTON = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت به منو", callback_data="back_to_menu")]])
+
+PHONE_REQUEST_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton("📱 ارسال شماره", request_contact=True)],
+        [KeyboardButton("🔙 بازگشت به منو")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
 
-    if not users:
-        return None
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "کاربران تایید شده"
-
-    headers = ["ردیف", "آیدی کاربر", "تلفن", "نام کامل", "کد ملی", "تاریخ ثبت‌نام"]
-    ws.append(headers)
-
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    header_alignment = Alignment(horizontal='center', vertical='center')
-
-    for col in range(1, len(headers) + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-
-    for idx, user in enumerate(users, start=1):
-        ws.append([
-            idx,
-            user[1],
-            user[2],
-            user[3],
-            user[4],
-            user[5]
-        ])
+MENU_TEXT = "لطفا گزینه مورد نظر را انتخاب کنید:"
 
-    column_widths = [8, 15, 15, 25, 15, 20]
-    for i, width in enumerate(column_widths, 1):
-        col_letter = get_column_letter(i)
-        ws.column_dimensions[col_letter].width = width
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"users_{timestamp}.xlsx"
-    wb.save(filename)
-
-    return filename
-
-# --- کیبوردها ---
-def start_keyboard():
-    keyboard = [
-        [InlineKeyboardButton("تلگرام زرزنگ", url="https://t.me/ddingooa"),
-         InlineKeyboardButton("یوتیوب زرزنگ", url="https://www.youtube.com/zerzang")],
-        [InlineKeyboardButton("اینستاگرام زرزنگ", url="https://instagram.com/zerzang"),
-         InlineKeyboardButton("سایت زرزنگ", url="https://zerzang.com")],
-        [InlineKeyboardButton("ثبت نام سیگنال فیوچرز", callback_data="register_signal")],
-        [InlineKeyboardButton("پشتیبانی", callback_data="support")],
-        [InlineKeyboardButton("محاسبه حد ضرر", callback_data="calc_stop_loss")],
-        [InlineKeyboardButton("صرافی‌ها و بروکرهای ویژه", callback_data="exchanges_brokers")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def back_button():
-    return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت به منو", callback_data="back_to_menu")]])
-
-def phone_request_keyboard():
-    return ReplyKeyboardMarkup(
-        [
-            [KeyboardButton("📱 ارسال شماره", request_contact=True)],
-            [KeyboardButton("🔙 بازگشت به منو")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
+STOP_LOSS_PROMPT = (
+    "لطفاً مقادیر را به صورت زیر وارد کنید:\n\n"
+    "🔹 بالایی: سرمایه دلاری شما\n"
+    "🔸 پایینی: میزان ضرر دلاری مورد نظر\n\n"
+    "مثال:\n"
+    "20\n"
+    "3"
+)
+
+EXCHANGES_TEXT = (
+    "🔗 صرافی‌ها و بروکرهای ویژه:\n\n"
+    "1. [Binance](https://www.binance.com/)\n"
+    "2. [Bybit](https://www.bybit.com/)\n"
+    "3. [Deribit](https://www.deribit.com/)\n"
+    "4. [OKX](https://www.okx.com/)\n"
+    "5. [MEXC](https://www.mexc.com/)"
+)
 
 # --- سیستم سیگنال‌دهی ---
-def create_signal_keyboard(leverage):
+CAPITAL_PERCENTS = [
+    ("۰.۵٪ سرمایه", "0.5"),
+    ("۱٪ سرمایه", "1"),
+    ("۱.۵٪ سرمایه", "1.5"),
+    ("۲٪ سرمایه", "2"),
+    ("۳٪ سرمایه", "3"),
+    ("۴٪ سرمایه", "4"),
+    ("۵٪ سرمایه", "5"),
+]
+
+# تعداد کیبوردهای سیگنال نگه داشته شده در حافظه
+SIGNAL_KEYBOARD_CACHE_SIZE = 64
+
+@lru_cache(maxsize=SIGNAL_KEYBOARD_CACHE_SIZE)
+def create_signal_keyboard(signal_id):
+    # callback_data فقط شامل شماره سیگنال و درصد است: cp:<signal_id>:<percent>
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("۰.۵٪ سرمایه", callback_data=f"capital_percent:0.5:{leverage}")],
-        [InlineKeyboardButton("۱٪ سرمایه", callback_data=f"capital_percent:1:{leverage}")],
-        [InlineKeyboardButton("۱.۵٪ سرمایه", callback_data=f"capital_percent:1.5:{leverage}")],
-        [InlineKeyboardButton("۲٪ سرمایه", callback_data=f"capital_percent:2:{leverage}")],
-        [InlineKeyboardButton("۳٪ سرمایه", callback_data=f"capital_percent:3:{leverage}")],
-        [InlineKeyboardButton("۴٪ سرمایه", callback_data=f"capital_percent:4:{leverage}")],
-        [InlineKeyboardButton("۵٪ سرمایه", callback_data=f"capital_percent:5:{leverage}")]
+        [InlineKeyboardButton(label, callback_data=f"cp:{signal_id}:{percent}")]
+        for label, percent in CAPITAL_PERCENTS
     ])
 
-def format_signal_message(entry, sl, tp, leverage):
-    # تشخیص نوع پوزیشن
-    position_type = "Long" if float(sl) < float(entry) else "Short"
-    
-    # محاسبه درصد ضرر
-    loss_percent = abs((float(sl) - float(entry)) / float(entry)) * 100
-    
+SIGNAL_MESSAGE_TEMPLATE = (
+    "📈 <b>سیگنال معاملاتی جدید</b>\n\n"
+    "📍 نوع پوزیشن: <b>{0.position_type}</b>\n"
+    "🎯 قیمت ورود: <b>{0.entry}</b>\n"
+    "🛑 حد ضرر (SL): <b>{0.sl}</b>\n"
+    "✅ حد سود (TP): <b>{0.tp}</b>\n"
+    "⚖️ اهرم (Leverage): <b>{0.leverage}x</b>\n"
+    "📉 درصد ضرر: <b>{0.loss_percent:.2f}%</b>\n\n"
+    "<i>لطفاً درصدی از سرمایه که مایلید درگیر این معامله شود را انتخاب کنید:</i>"
+).format
+
+def format_signal_message(signal):
+    return SIGNAL_MESSAGE_TEMPLATE(signal)
+
+SIGNAL_UPDATED_NOTE = "✏️ <b>به‌روزرسانی سیگنال #{0}</b>"
+SIGNAL_CLOSED_NOTE = "🔒 <b>سیگنال #{0} بسته شد</b>"
+
+def format_signal_edit(signal, closed, note=None):
+    """متن جایگزین پیام قبلی سیگنال؛ یادداشت ادمین escape می‌شود"""
+    header = (SIGNAL_CLOSED_NOTE if closed else SIGNAL_UPDATED_NOTE).format(signal.id)
+    if note:
+        header += f"\n📝 {html.escape(note)}"
+    return f"{header}\n\n{format_signal_message(signal)}"
+
+SIGNAL_EVENT_MESSAGES = {
+    ENTRY: "🎯 قیمت به نقطه ورود سیگنال #{id} رسید ({price})",
+    TP: "✅ حد سود سیگنال #{id} فعال شد ({price}) 🎉",
+    SL: "🛑 حد ضرر سیگنال #{id} فعال شد ({price})",
+}
+
+def format_signal_update(signal, event, price):
     return (
-        f"📈 <b>سیگنال معاملاتی جدید</b>\n\n"
-        f"📍 نوع پوزیشن: <b>{position_type}</b>\n"
-        f"🎯 قیمت ورود: <b>{entry}</b>\n"
-        f"🛑 حد ضرر (SL): <b>{sl}</b>\n"
-        f"✅ حد سود (TP): <b>{tp}</b>\n"
-        f"⚖️ اهرم (Leverage): <b>{leverage}x</b>\n"
-        f"📉 درصد ضرر: <b>{loss_percent:.2f}%</b>\n\n"
-        f"<i>لطفاً درصدی از سرمایه که مایلید درگیر این معامله شود را انتخاب کنید:</i>"
+        SIGNAL_EVENT_MESSAGES[event].format(id=signal.id, price=price) + "\n\n"
+        f"📍 {signal.symbol} | {signal.position_type}\n"
+        f"🎯 ورود: {signal.entry} | 🛑 SL: {signal.sl} | ✅ TP: {signal.tp}"
     )
 
-async def send_signal_to_users(context: ContextTypes.DEFAULT_TYPE, entry, sl, tp, leverage):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT user_id FROM verified_users')
-    verified_users = [row[0] for row in cur.fetchall()]
-    conn.close()
-
-    success = 0
-    failed = 0
-    message = format_signal_message(entry, sl, tp, leverage)
-    keyboard = create_signal_keyboard(leverage)
+# --- صف ارسال همگانی ---
+JOB_KIND_LABELS = {
+    'signal': "سیگنال",
+    'signal_update': "وضعیت سیگنال",
+    'signal_edit': "ویرایش سیگنال",
+    'message': "پیام",
+}
+
+JOB_STATUS_LABELS = {
+    'queued': "🕒 در صف",
+    'running': "🚀 در حال ارسال",
+    'done': "✅ پایان یافته",
+    'cancelled': "⛔️ لغو شده",
+    'failed': "❌ خطا",
+}
+
+def format_job_status(job, report=None):
+    processed = job['success'] + job['failed']
+    percent = (processed / job['total'] * 100) if job['total'] else 100
+    text = (
+        f"📢 ارسال همگانی #{job['id']} ({JOB_KIND_LABELS.get(job['kind'], job['kind'])})\n"
+        f"وضعیت: {JOB_STATUS_LABELS.get(job['status'], job['status'])}\n\n"
+        f"🔹 پیشرفت: {processed}/{job['total']} ({percent:.0f}%)\n"
+        f"🔹 تعداد موفق: {job['success']}\n"
+        f"🔹 تعداد ناموفق: {job['failed']}"
+    )
+    if report:
+        text += f"\n\n{report}"
+    return text
 
-    for user_id in verified_users:
+async def edit_job_status_message(bot, job, report=None):
+    if not job['status_message_id']:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job['chat_id'],
+            message_id=job['status_message_id'],
+            text=format_job_status(job, report)
+        )
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            logger.error(f"Error editing broadcast status #{job['id']}: {e}")
+
+async def build_job_sender(bot, job):
+    payload = json.loads(job['payload'])
+    if job['kind'] == 'signal':
+        if 'signal_id' in payload:
+            signal = await get_signal(payload['signal_id'])
+        else:
+            # کارهای ثبت شده پیش از ذخیره سیگنال‌ها در جدول signals
+            signal = await create_signal(payload['entry'], payload['sl'], payload['tp'], payload['leverage'])
+        message = format_signal_message(signal)
+        keyboard = create_signal_keyboard(signal.id)
+        personal = PersonalizedSignal(signal)
+        sent = []
+
+        async def send(user_id):
+            text = message + personal.text(user_id)
+            result = await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                parse_mode='HTML',
+                reply_markup=keyboard
+            )
+            sent.append((user_id, result.message_id, content_hash(text)))
+
+        async def flush():
+            # شناسه پیام‌ها برای ویرایش بعدی (/update_signal و /close_signal)
+            if sent:
+                await db.save_signal_messages(signal.id, sent[:])
+                sent.clear()
+        send.prepare = personal.prepare
+        send.flush = flush
+    elif job['kind'] == 'signal_edit':
+        send = await build_signal_edit_sender(bot, payload)
+    elif job['kind'] == 'signal_update':
+        signal = await get_signal(payload['signal_id'])
+        message = format_signal_update(signal, payload['event'], payload['price'])
+
+        async def send(user_id):
+            await bot.send_message(
+                chat_id=user_id,
+                text=message
+            )
+    else:
+        async def send(user_id):
+            await bot.send_message(
+                chat_id=user_id,
+                text=payload['text']
+            )
+    return send
+
+async def build_signal_edit_sender(bot, payload):
+    """
+    ویرایش پیام‌های قبلی یک سیگنال به جای ارسال پیام جدید
+
+    گیرندگان از جدول signal_messages خوانده می‌شوند و پیام‌هایی که هش متن جدیدشان با
+    متن فعلی یکی است اصلاً به API نمی‌روند.
+    """
+    signal = await get_signal(payload['signal_id'])
+    closed = payload.get('closed', False)
+    message = format_signal_edit(signal, closed, payload.get('note'))
+    keyboard = None if closed else create_signal_keyboard(signal.id)
+    personal = PersonalizedSignal(signal)
+    messages = {}
+    texts = {}
+    edited = []
+
+    async def recipients(last_user_id, limit):
+        rows = await db.get_signal_messages(signal.id, last_user_id, limit)
+        messages.clear()
+        messages.update((user_id, (message_id, old_hash)) for user_id, message_id, old_hash in rows)
+        return [row[0] for row in rows]
+
+    async def prepare(user_ids):
+        await personal.prepare(user_ids)
+        texts.clear()
+        for user_id in user_ids:
+            text = message + personal.text(user_id)
+            texts[user_id] = (text, content_hash(text))
+
+    def select(user_ids):
+        return [user_id for user_id in user_ids if texts[user_id][1] != messages[user_id][1]]
+
+    async def send(user_id):
+        text, new_hash = texts[user_id]
         try:
-            await context.bot.send_message(
+            await bot.edit_message_text(
                 chat_id=user_id,
-                text=message,
+                message_id=messages[user_id][0],
+                text=text,
                 parse_mode='HTML',
                 reply_markup=keyboard
             )
-            success += 1
-        except Exception as e:
-            logger.error(f"Error sending signal to {user_id}: {e}")
-            failed += 1
-
-    return success, failed, len(verified_users)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                raise
+        edited.append((user_id, new_hash))
+
+    async def flush():
+        if edited:
+            await db.update_signal_message_hashes(signal.id, edited[:])
+            edited.clear()
+
+    send.recipients = recipients
+    send.prepare = prepare
+    send.select = select
+    send.flush = flush
+    return send
+
+async def run_broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """اجرای یک کار ارسال همگانی به صورت دسته‌ای؛ پس از هر دسته آخرین آیدی ذخیره می‌شود"""
+    job_id = context.job.data
+    job = await db.get_broadcast_job(job_id)
+    if not job or job['status'] not in ('queued', 'running'):
+        return
 
-def calculate_trade_amount(capital, percent, leverage):
-    """محاسبه سرمایه ورودی به معامله با اعمال اهرم"""
-    return capital * (percent / 100) * leverage
+    await db.update_broadcast_job(job_id, status='running')
+    job['status'] = 'running'
+    stats = BroadcastStats(job['total'] - job['success'] - job['failed'])
+    base_success, base_failed = job['success'], job['failed']
+    last_progress = 0
 
-def calculate_loss_amount(trade_amount, entry, sl):
-    """محاسبه ضرر دلاری در صورت فعال شدن SL با دقت بالا"""
     try:
-        entry = float(entry)
-        sl = float(sl)
-        trade_amount = float(trade_amount)
-        
-        if entry <= 0 or sl <= 0 or trade_amount <= 0:
-            return 0
-            
-        # محاسبه درصد ضرر
-        loss_percent = abs(entry - sl) / entry
-        
-        # محاسبه ضرر دلاری
-        loss_amount = trade_amount * loss_percent
-        
-        return loss_amount
-    except:
-        return 0
+        # کاربران ممکن است در پروسه دیگری تایید شده باشند
+        await check_recipients(context)
+        send = await build_job_sender(context.bot, job)
+        while True:
+            if (await db.get_broadcast_job(job_id))['status'] == 'cancelled':
+                job['status'] = 'cancelled'
+                break
+
+            if hasattr(send, 'recipients'):
+                user_ids = await send.recipients(job['last_user_id'], BROADCAST_CHUNK_SIZE)
+            else:
+                user_ids = recipient_cache.after(job['last_user_id'], BROADCAST_CHUNK_SIZE)
+            if not user_ids:
+                job['status'] = 'done'
+                break
+
+            if hasattr(send, 'prepare'):
+                await send.prepare(user_ids)
+            targets = send.select(user_ids) if hasattr(send, 'select') else user_ids
+            stats.skip(len(user_ids) - len(targets))
+            await fan_out(targets, send, stats=stats)
+            if hasattr(send, 'flush'):
+                await send.flush()
+            await record_deliveries(job_id, stats)
+            job['last_user_id'] = user_ids[-1]
+            job['success'] = base_success + stats.success
+            job['failed'] = base_failed + stats.failed
+            job['total'] = max(job['total'], job['success'] + job['failed'])
+            await db.update_broadcast_job(
+                job_id,
+                last_user_id=job['last_user_id'],
+                success=job['success'],
+                failed=job['failed'],
+                total=job['total']
+            )
+
+            if stats.elapsed - last_progress >= PROGRESS_INTERVAL:
+                last_progress = stats.elapsed
+                await edit_job_status_message(context.bot, job)
+    except Exception as e:
+        logger.error(f"Error in broadcast job #{job_id}: {e}")
+        job['status'] = 'failed'
+
+    if job['status'] == 'cancelled':
+        await db.update_broadcast_job(job_id, success=job['success'], failed=job['failed'])
+    else:
+        await db.update_broadcast_job(job_id, status=job['status'])
+    logger.info(f"📢 ارسال همگانی #{job_id} به پایان رسید: {job['status']}")
+    await edit_job_status_message(context.bot, job, stats.report())
+
+async def enqueue_broadcast(bot, job_queue, chat_id, kind, payload, total=None):
+    """ثبت کار ارسال همگانی و ارسال فوری شماره آن به چت ادمین"""
+    if total is None:
+        total = len(recipient_cache)
+    job_id = await db.create_broadcast_job(kind, payload, chat_id, total)
+    job = await db.get_broadcast_job(job_id)
+    status_message = await bot.send_message(chat_id=chat_id, text=format_job_status(job))
+    await db.update_broadcast_job(job_id, status_message_id=status_message.message_id)
+    job_queue.run_once(run_broadcast_job, 0, data=job_id, name=f"broadcast:{job_id}")
+    return job_id
+
+async def resume_broadcast_jobs(application: Application):
+    """ادامه کارهای ناتمام پس از راه‌اندازی مجدد"""
+    for job_id in await db.get_unfinished_broadcast_jobs():
+        logger.info(f"🔁 ادامه ارسال همگانی #{job_id}")
+        application.job_queue.run_once(run_broadcast_job, 0, data=job_id, name=f"broadcast:{job_id}")
+
+# --- کش گیرندگان ---
+async def load_recipients():
+    recipient_cache.load(await db.get_verified_user_ids())
+    logger.info(f"👥 کش گیرندگان بارگذاری شد: {len(recipient_cache)} کاربر")
+
+async def check_recipients(context: ContextTypes.DEFAULT_TYPE):
+    """مقایسه ارزان کش با دیتابیس و بارگذاری مجدد در صورت اختلاف"""
+    if await db.get_verified_users_fingerprint() != recipient_cache.fingerprint():
+        logger.warning("⚠️ کش گیرندگان با دیتابیس هماهنگ نبود؛ بارگذاری مجدد")
+        await load_recipients()
+
+# --- پایش قیمت سیگنال‌ها ---
+signal_monitor = None
+signal_monitor_task = None
+
+async def start_signal_monitor(application: Application):
+    global signal_monitor, signal_monitor_task
+    if not PRICE_FEED:
+        return
+
+    async def on_hit(signal_id, event, price):
+        await set_signal_status(signal_id, 'active' if event == ENTRY else event)
+        await enqueue_broadcast(
+            application.bot, application.job_queue, ADMIN_CHAT_ID, 'signal_update',
+            {'signal_id': signal_id, 'event': event, 'price': price}
+        )
+
+    signal_monitor = SignalMonitor(on_hit)
+    for signal in await get_open_signals():
+        signal_monitor.watch(signal)
+    feed = create_feed(PRICE_FEED, signal_monitor.symbols)
+    signal_monitor_task = asyncio.create_task(signal_monitor.run(feed))
+    logger.info(f"📡 {len(signal_monitor.signals)} سیگنال باز تحت پایش قرار گرفت")
+
+async def stop_signal_monitor():
+    if signal_monitor_task:
+        signal_monitor_task.cancel()
+        try:
+            await signal_monitor_task
+        except asyncio.CancelledError:
+            pass
+
+# --- گزارش تحویل ---
+async def record_deliveries(job_id, stats):
+    """ثبت دسته‌ای نتیجه تحویل و کنار گذاشتن گیرندگانی که ربات را مسدود یا حساب را حذف کرده‌اند"""
+    delivered, failures, dead = stats.drain()
+    if not delivered and not failures:
+        return
+    await db.log_deliveries(job_id, delivered, failures, dead)
+    if dead:
+        logger.info(f"🧹 {len(dead)} گیرنده غیرفعال شد")
+
+async def prune_delivery_log(context: ContextTypes.DEFAULT_TYPE):
+    removed = await db.prune_delivery_log(DELIVERY_LOG_RETENTION_DAYS)
+    if removed:
+        logger.info(f"🧹 {removed} رکورد قدیمی گزارش تحویل حذف شد")
+
+def format_delivery_report(days, rows, active, inactive):
+    message = (
+        f"📊 وضعیت تحویل {days} روز اخیر\n"
+        f"👥 گیرندگان فعال: {active} | غیرفعال: {inactive}\n\n"
+    )
+    if not rows:
+        return message + "هنوز ارسالی ثبت نشده است."
+    for day, success, failures in rows:
+        failed = sum(failures.values())
+        total = success + failed
+        rate = success / total * 100 if total else 100.0
+        message += f"🗓 {day}: ✅ {success} | ❌ {failed} ({rate:.1f}%)\n"
+        if failures:
+            message += "   " + "، ".join(
+                f"{DELIVERY_STATUS_LABELS.get(status, status)}×{count}"
+                for status, count in sorted(failures.items(), key=lambda item: -item[1])
+            ) + "\n"
+    return message
+
+async def delivery_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    days = int(context.args[0]) if context.args and context.args[0].isdigit() else DELIVERY_REPORT_DAYS
+    days = max(1, min(days, DELIVERY_LOG_RETENTION_DAYS))
+    rows = await db.get_delivery_report(days)
+    active, inactive = await db.get_recipient_counts()
+    await update.message.reply_text(format_delivery_report(days, rows, active, inactive))
 
 # --- دستورات ربات ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
+    # کاربری که ربات را رفع مسدودیت کرده دوباره پیام‌ها را دریافت می‌کند
+    if await db.reactivate_user(update.effective_user.id):
+        logger.info(f"🔄 کاربر {update.effective_user.id} دوباره فعال شد")
     await update.message.reply_text(
         "سلام! به ربات زرزنگ خوش آمدید.\nلطفا گزینه مورد نظر را انتخاب کنید:",
-        reply_markup=start_keyboard()
+        reply_markup=START_KEYBOARD
     )
 
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -313,68 +599,208 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ شما دسترسی ندارید!")
         return
 
-    if context.user_data.get('admin_broadcast_mode'):
-        conn = sqlite3.connect(DB_NAME)
-        cur = conn.cursor()
-        cur.execute('SELECT user_id FROM verified_users')
-        verified_users = [row[0] for row in cur.fetchall()]
-        conn.close()
-
-        message = update.message.text
-        success = 0
-        failed = 0
-
-        for user_id in verified_users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
-                success += 1
-            except Exception as e:
-                logger.error(f"Error sending to {user_id}: {e}")
-                failed += 1
-
-        await update.message.reply_text(
-            f"✅ پیام به {success} کاربر ارسال شد\n"
-            f"❌ تعداد ناموفق: {failed}\n"
-            f"🔹 کل کاربران: {len(verified_users)}"
+    if isinstance(get_state(context), AdminBroadcastInput):
+        await enqueue_broadcast(
+            context.bot, context.job_queue, update.message.chat_id, 'message', {'text': update.message.text}
         )
-        context.user_data.pop('admin_broadcast_mode', None)
+        clear_state(context)
     else:
-        context.user_data['admin_broadcast_mode'] = True
+        set_state(context, AdminBroadcastInput())
         await update.message.reply_text(
             "📢 پیام خود را برای کاربران تایید شده وارد کنید:",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ لغو", callback_data="cancel_broadcast")]])
         )
 
+def format_users_page(users, has_prev, has_next, search=None):
+    message = "📋 لیست کاربران تایید شده:\n"
+    if search:
+        message += f"🔎 جستجو: {search}\n"
+    message += "\n"
+    for user in users:
+        message += (
+            f"👤 نام: {user[3]}\n"
+            f"📞 تلفن: {user[2]}\n"
+            f"🆔 آیدی: {user[1]}\n"
+            f"📌 کد ملی: {user[4]}\n"
+            f"🗓 تاریخ ثبت: {user[5]}\n"
+            "──────────────────\n"
+        )
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"users_page:prev:{users[0][0]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"users_page:next:{users[-1][0]}"))
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id != ADMIN_CHAT_ID:
         await update.message.reply_text("❌ شما دسترسی ندارید!")
         return
 
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM verified_users')
-    users = cur.fetchall()
-    conn.close()
+    search = ' '.join(context.args).strip() or None
+    context.user_data['users_search'] = search
+    users, has_prev, has_next = await db.get_verified_users_page(USERS_PAGE_SIZE, search=search)
 
     if not users:
-        await update.message.reply_text("هنوز کاربری تایید نشده است")
+        if search:
+            await update.message.reply_text(f"❌ کاربری با «{search}» یافت نشد.")
+        else:
+            await update.message.reply_text("هنوز کاربری تایید نشده است")
         return
 
-    message = "📋 لیست کاربران تایید شده:\n\n"
-    for user in users:
+    message, keyboard = format_users_page(users, has_prev, has_next, search)
+    await update.message.reply_text(message, reply_markup=keyboard)
+
+# --- صف بررسی درخواست‌ها ---
+VERIFIED_TEXT = "✅ پرداخت شما تایید شد! ثبت‌نام تکمیل گردید."
+REJECTED_TEXT = "❌ پرداخت شما رد شد. لطفاً با پشتیبانی تماس بگیرید."
+
+def format_pending_page(rows, total, offset, selected):
+    message = f"🧾 درخواست‌های در انتظار تایید ({total}):\n"
+    if selected:
+        message += f"☑️ انتخاب شده: {len(selected)}\n"
+    message += "\n"
+    buttons = []
+    for index, (user_id, phone, full_name, nid, date) in enumerate(rows, start=offset + 1):
         message += (
-            f"👤 نام: {user[3]}\n"
-            f"📞 تلفن: {user[2]}\n"
-            f"🆔 آیدی: {user[1]}\n"
-            f"📌 کد ملی: {user[4]}\n"
-            f"🗓 تاریخ ثبت: {user[5]}\n"
+            f"{index}. 👤 {full_name} | 📞 {phone}\n"
+            f"🆔 {user_id} | 📌 {nid} | 🗓 {date}\n"
             "──────────────────\n"
         )
+        mark = "☑️" if user_id in selected else "⬜️"
+        buttons.append([InlineKeyboardButton(f"{mark} {index}. {full_name}", callback_data=f"pq:t:{offset}:{user_id}")])
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"pq:p:{max(0, offset - PENDING_PAGE_SIZE)}"))
+    navigation.append(InlineKeyboardButton("☑️ همه این صفحه", callback_data=f"pq:a:{offset}"))
+    if offset + PENDING_PAGE_SIZE < total:
+        navigation.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"pq:p:{offset + PENDING_PAGE_SIZE}"))
+    buttons.append(navigation)
+    if selected:
+        buttons.append([
+            InlineKeyboardButton(f"✅ تایید ({len(selected)})", callback_data=f"pq:v:{offset}"),
+            InlineKeyboardButton(f"❌ رد ({len(selected)})", callback_data=f"pq:r:{offset}"),
+        ])
+        buttons.append([InlineKeyboardButton("🔄 لغو انتخاب", callback_data=f"pq:c:{offset}")])
+    return message, InlineKeyboardMarkup(buttons)
+
+async def notify_users(bot, user_ids, text):
+    """اطلاع‌رسانی به گروهی از کاربران از مسیر ارسال با محدودیت نرخ"""
+    async def send(user_id):
+        await bot.send_message(chat_id=user_id, text=text)
+
+    stats = await fan_out(user_ids, send)
+    await record_deliveries(None, stats)
+    if stats.failed:
+        logger.warning(f"⚠️ اطلاع‌رسانی به {stats.failed} کاربر ناموفق بود")
+
+async def pending_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    context.user_data['pending_selected'] = []
+    rows, total = await db.get_pending_page(PENDING_PAGE_SIZE)
+    if not rows:
+        await update.message.reply_text("✅ درخواستی در انتظار تایید نیست.")
+        return
+
+    message, keyboard = format_pending_page(rows, total, 0, set())
+    await update.message.reply_text(message, reply_markup=keyboard)
+
+async def handle_pending_action(query, context: ContextTypes.DEFAULT_TYPE):
+    """دکمه‌های صف بررسی: pq:<عمل>:<offset>[:<آیدی کاربر>]"""
+    _, action, offset, *rest = query.data.split(":")
+    offset = int(offset)
+    selected = set(context.user_data.get('pending_selected', []))
+
+    if action == "t":
+        selected ^= {int(rest[0])}
+    elif action == "a":
+        rows, _ = await db.get_pending_page(PENDING_PAGE_SIZE, offset)
+        selected |= {row[0] for row in rows}
+    elif action == "c":
+        selected.clear()
+    elif action in ("v", "r") and selected:
+        if action == "v":
+            user_ids = [row[0] for row in await db.verify_pending_users(selected)]
+            text, summary = VERIFIED_TEXT, f"✅ {len(user_ids)} درخواست تایید شد."
+        else:
+            user_ids = await db.reject_pending_users(selected)
+            text, summary = REJECTED_TEXT, f"❌ {len(user_ids)} درخواست رد شد."
+        selected.clear()
+        context.application.create_task(notify_users(context.bot, user_ids, text))
+        await context.bot.send_message(chat_id=query.message.chat_id, text=summary)
+
+    context.user_data['pending_selected'] = list(selected)
+    rows, total = await db.get_pending_page(PENDING_PAGE_SIZE, offset)
+    if not rows and offset > 0:
+        offset = max(0, offset - PENDING_PAGE_SIZE)
+        rows, total = await db.get_pending_page(PENDING_PAGE_SIZE, offset)
+    if not rows:
+        await query.edit_message_text("✅ درخواستی در انتظار تایید نیست.")
+        return
+
+    message, keyboard = format_pending_page(rows, total, offset, selected)
+    try:
+        await query.edit_message_text(message, reply_markup=keyboard)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
+
+verification_actions = Coalescer()
+
+async def notify_user(bot, user_id, text):
+    # تراکنش قبلاً انجام شده؛ خطای ارسال نباید نتیجه را خراب کند
+    try:
+        await bot.send_message(chat_id=user_id, text=text)
+    except TelegramError as e:
+        logger.error(f"Error notifying {user_id}: {e}")
+
+async def process_verification(context: ContextTypes.DEFAULT_TYPE, data):
+    """
+    تایید یا رد یک درخواست در یک تراکنش؛ خروجی متن نتیجه برای پیام ادمین
+
+    داده دکمه شناسه همان درخواست است (هر ارسال فیش شناسه تازه دارد)، پس ارسال دوباره
+    کاربر بعد از رد یا حذف، کلید جدیدی برای Coalescer است. دکمه‌های قدیمی با آیدی کاربر
+    همچنان پذیرفته می‌شوند.
+    """
+    action, key = data.split(":", 1)
+    legacy = key.isdigit()
+
+    if action == "verify_payment":
+        if legacy:
+            rows = await db.verify_pending_users([int(key)])
+            row = rows[0] if rows else None
+        else:
+            row = await db.verify_pending_request(key)
+        if not row:
+            return "❌ درخواست تأیید یافت نشد!"
+        user_id, phone, full_name, nid = row
+        await notify_user(context.bot, user_id, VERIFIED_TEXT)
+        return (
+            f"✅ کاربر جدید ثبت شد:\n\n"
+            f"👤 نام: {full_name}\n"
+            f"📞 تلفن: {phone}\n"
+            f"🆔 آیدی: {user_id}\n"
+            f"📌 کد ملی: {nid}\n"
+            f"🗓 تاریخ ثبت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
 
-    await update.message.reply_text(message)
+    if legacy:
+        rejected = await db.reject_pending_users([int(key)])
+        user_id = rejected[0] if rejected else None
+    else:
+        user_id = await db.reject_pending_request(key)
+    if user_id is None:
+        return "❌ درخواست تأیید یافت نشد!"
+    await notify_user(context.bot, user_id, REJECTED_TEXT)
+    return (
+        f"❌ پرداخت کاربر رد شد.\n\n"
+        f"توسط ادمین در تاریخ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} انجام شد"
+    )
 
 async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id != ADMIN_CHAT_ID:
@@ -388,14 +814,9 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.args[0]
 
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM verified_users WHERE user_id = ?', (user_id,))
-        user = cur.fetchone()
+        user = await db.remove_verified_user(user_id)
 
         if user:
-            cur.execute('DELETE FROM verified_users WHERE user_id = ?', (user_id,))
-            conn.commit()
             await update.message.reply_text(
                 f"✅ کاربر با مشخصات زیر حذف شد:\n\n"
                 f"👤 نام: {user[3]}\n"
@@ -408,212 +829,427 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error removing user: {e}")
         await update.message.reply_text("❌ خطا در حذف کاربر")
-    finally:
-        conn.close()
 
 async def export_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id != ADMIN_CHAT_ID:
         await update.message.reply_text("❌ شما دسترسی ندارید!")
         return
 
-    try:
-        excel_file = create_excel_file()
-
-        if not excel_file:
-            await update.message.reply_text("❌ هیچ کاربری برای خروجی وجود ندارد")
-            return
+    fmt = EXPORT_FORMATS.get(context.args[0].lower(), 'xlsx') if context.args else 'xlsx'
 
+    try:
         await context.bot.send_chat_action(
-            chat_id=update.message.chat_id, 
+            chat_id=update.message.chat_id,
             action="upload_document"
         )
 
+        # ساخت فایل در استخر پروسه محاسبات (یا ترد) تا حلقه رویداد آزاد بماند
+        export = await sharding.run_cpu(build_export, fmt)
+
+        if not export:
+            await update.message.reply_text("❌ هیچ کاربری برای خروجی وجود ندارد")
+            return
+
+        data, filename = export
         await update.message.reply_document(
-            document=open(excel_file, 'rb'),
-            filename='users.xlsx',
+            document=data,
+            filename=filename,
             caption='📊 لیست کامل کاربران تایید شده'
         )
 
-        os.remove(excel_file)
-
     except Exception as e:
-        logger.error(f"Error in Excel export: {e}")
-        await update.message.reply_text("❌ خطا در تولید فایل اکسل")
+        logger.error(f"Error in export: {e}")
+        await update.message.reply_text("❌ خطا در تولید فایل خروجی")
 
 async def send_signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id != ADMIN_CHAT_ID:
         await update.message.reply_text("❌ شما دسترسی ندارید!")
         return
 
-    if context.user_data.get('awaiting_signal'):
+    if isinstance(get_state(context), SignalInput):
         try:
             args = context.args
             if len(args) < 4:
                 raise ValueError("Invalid arguments")
 
-            entry = args[0]
-            sl = args[1]
-            tp = args[2]
-            leverage = args[3]
-
-            success, failed, total = await send_signal_to_users(context, entry, sl, tp, leverage)
+            entry, sl, tp, leverage = args[:4]
+            for value in (entry, sl, tp, leverage):
+                if float(value) <= 0:
+                    raise ValueError("Invalid arguments")
+            symbol = normalize_symbol(args[4]) if len(args) > 4 else None
 
-            # تشخیص نوع پوزیشن برای گزارش ادمین
-            position_type = "Long" if float(sl) < float(entry) else "Short"
-            loss_percent = abs((float(sl) - float(entry)) / float(entry)) * 100
+            signal = await create_signal(entry, sl, tp, leverage, symbol)
+            # محاسبه ضرایب همه دکمه‌ها هنگام ارسال تا پاسخ هر کاربر فقط یک ضرب باشد
+            for _, percent in CAPITAL_PERCENTS:
+                signal.table.factors(percent)
 
             await update.message.reply_text(
-                f"✅ سیگنال با موفقیت ارسال شد!\n\n"
-                f"🔹 تعداد موفق: {success}\n"
-                f"🔹 تعداد ناموفق: {failed}\n"
-                f"🔹 کل کاربران: {total}\n\n"
-                f"📊 اطلاعات سیگنال:\n"
-                f"📍 نوع پوزیشن: {position_type}\n"
+                f"📊 اطلاعات سیگنال #{signal.id}{f' ({symbol})' if symbol else ''}:\n"
+                f"📍 نوع پوزیشن: {signal.position_type}\n"
                 f"🎯 ورود: {entry}\n"
                 f"🛑 SL: {sl}\n"
                 f"✅ TP: {tp}\n"
                 f"⚖️ اهرم: {leverage}x\n"
-                f"📉 درصد ضرر: {loss_percent:.2f}%"
+                f"📉 درصد ضرر: {signal.loss_percent:.2f}%"
             )
+            await enqueue_broadcast(
+                context.bot, context.job_queue, update.message.chat_id, 'signal', {'signal_id': signal.id}
+            )
+            if signal_monitor:
+                signal_monitor.watch(signal)
 
-            context.user_data.pop('awaiting_signal', None)
+            clear_state(context)
         except Exception as e:
             logger.error(f"Error sending signal: {e}")
             await update.message.reply_text(
-                "❌ فرمت صحیح: /send_signal <entry> <sl> <tp> <leverage>\n"
-                "مثال: /send_signal 50000 49500 52000 10"
+                "❌ فرمت صحیح: /send_signal <entry> <sl> <tp> <leverage> [symbol]\n"
+                "مثال: /send_signal 50000 49500 52000 10 BTCUSDT"
             )
     else:
-        context.user_data['awaiting_signal'] = True
+        set_state(context, SignalInput())
         await update.message.reply_text(
             "📈 لطفاً اطلاعات سیگنال را به فرمت زیر وارد کنید:\n\n"
-            "<code>/send_signal [قیمت ورود] [حد ضرر] [حد سود] [اهرم]</code>\n\n"
+            "<code>/send_signal [قیمت ورود] [حد ضرر] [حد سود] [اهرم] [نماد]</code>\n\n"
+            "با وارد کردن نماد (اختیاری)، رسیدن قیمت به ورود/حد سود/حد ضرر به کاربران اطلاع داده می‌شود.\n\n"
             "مثال:\n"
-            "<code>/send_signal 50000 49500 52000 10</code>",
+            "<code>/send_signal 50000 49500 52000 10 BTCUSDT</code>",
             parse_mode="HTML"
         )
 
+async def enqueue_signal_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, signal, closed, note=None):
+    total = await db.count_signal_messages(signal.id)
+    if not total:
+        await update.message.reply_text(f"⚠️ پیامی از سیگنال #{signal.id} برای ویرایش ثبت نشده است.")
+        return
+    payload = {'signal_id': signal.id, 'closed': closed}
+    if note:
+        payload['note'] = note
+    await enqueue_broadcast(
+        context.bot, context.job_queue, update.message.chat_id, 'signal_edit', payload, total=total
+    )
+
+async def update_signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/update_signal <شماره> <sl> <tp> [توضیح]: ویرایش پیام‌های ارسال شده سیگنال"""
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    args = context.args
+    try:
+        if len(args) < 3 or not args[0].isdigit():
+            raise ValueError("Invalid arguments")
+        sl, tp = str(to_decimal(args[1])), str(to_decimal(args[2]))
+    except ValueError:
+        await update.message.reply_text(
+            "❌ فرمت صحیح: /update_signal <شماره سیگنال> <sl> <tp> [توضیح]\n"
+            "مثال: /update_signal 12 49800 52500 انتقال حد ضرر"
+        )
+        return
+
+    signal = await get_signal(int(args[0]))
+    if not signal:
+        await update.message.reply_text(f"❌ سیگنال #{args[0]} یافت نشد.")
+        return
+    if signal.status not in ('open', 'active'):
+        await update.message.reply_text(f"⚠️ سیگنال #{signal.id} بسته شده است.")
+        return
+    if (to_decimal(tp) > to_decimal(signal.entry)) != (signal.position_type == "Long"):
+        await update.message.reply_text(
+            f"❌ حد سود باید در سمت سود نقطه ورود ({signal.entry}) پوزیشن {signal.position_type} باشد."
+        )
+        return
+
+    signal = await update_signal_levels(signal.id, sl, tp)
+    if signal_monitor:
+        signal_monitor.watch(signal)
+    await enqueue_signal_edit(update, context, signal, False, ' '.join(args[3:]) or None)
+
+async def close_signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/close_signal <شماره> [توضیح]: بستن سیگنال و ویرایش پیام‌های ارسال شده"""
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("⚠️ فرمت صحیح: /close_signal <شماره سیگنال> [توضیح]")
+        return
+
+    signal = await get_signal(int(context.args[0]))
+    if not signal:
+        await update.message.reply_text(f"❌ سیگنال #{context.args[0]} یافت نشد.")
+        return
+
+    await set_signal_status(signal.id, 'closed')
+    if signal_monitor:
+        signal_monitor.unwatch(signal.id)
+    await enqueue_signal_edit(update, context, signal, True, ' '.join(context.args[1:]) or None)
+
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("⚠️ لطفاً شماره ارسال را وارد کنید:\n/broadcast_status <شماره>")
+        return
+
+    job = await db.get_broadcast_job(int(context.args[0]))
+    if not job:
+        await update.message.reply_text(f"❌ ارسال همگانی #{context.args[0]} یافت نشد.")
+        return
+
+    await update.message.reply_text(format_job_status(job))
+
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("❌ شما دسترسی ندارید!")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("⚠️ لطفاً شماره ارسال را وارد کنید:\n/broadcast_cancel <شماره>")
+        return
+
+    job = await db.get_broadcast_job(int(context.args[0]))
+    if not job:
+        await update.message.reply_text(f"❌ ارسال همگانی #{context.args[0]} یافت نشد.")
+        return
+
+    if job['status'] not in ('queued', 'running'):
+        await update.message.reply_text(f"⚠️ ارسال همگانی #{job['id']} قبلاً به پایان رسیده است.")
+        return
+
+    await db.update_broadcast_job(job['id'], status='cancelled')
+    await update.message.reply_text(f"⛔️ ارسال همگانی #{job['id']} لغو شد.")
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     if query.data == "register_signal":
         context.user_data.clear()
-        context.user_data['registration_step'] = 'awaiting_phone'
+        set_state(context, Registration(step='awaiting_phone'))
         await query.edit_message_text("لطفاً شماره خود را با استفاده از دکمه زیر ارسال کنید:")
         await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="روی دکمه زیر بزنید:",
-            reply_markup=phone_request_keyboard()
+            reply_markup=PHONE_REQUEST_KEYBOARD
         )
 
     elif query.data == "support":
         await query.edit_message_text(
             "برای پشتیبانی با @ZerzangSupport تماس بگیرید.",
-            reply_markup=back_button()
+            reply_markup=BACK_BUTTON
         )
 
     elif query.data == "calc_stop_loss":
         context.user_data.clear()
-        context.user_data['awaiting_stop_loss'] = True
+        set_state(context, StopLossInput())
+        await query.edit_message_text(STOP_LOSS_PROMPT, reply_markup=BACK_BUTTON)
+
+    elif query.data == "risk_profile":
+        context.user_data.clear()
+        set_state(context, RiskProfileInput())
+        profile = await db.get_risk_profile(query.from_user.id)
+        current = (
+            f"📌 پروفایل فعلی: سرمایه {profile[0]:g} دلار، {profile[1]:g}٪ در هر معامله\n\n"
+            if profile else ""
+        )
         await query.edit_message_text(
+            f"{current}"
+            "با ثبت پروفایل، محاسبه حجم و ضرر هر سیگنال مستقیماً همراه سیگنال برای شما ارسال می‌شود.\n\n"
             "لطفاً مقادیر را به صورت زیر وارد کنید:\n\n"
             "🔹 بالایی: سرمایه دلاری شما\n"
-            "🔸 پایینی: میزان ضرر دلاری مورد نظر\n\n"
+            "🔸 پایینی: درصد سرمایه برای هر معامله\n\n"
             "مثال:\n"
-            "20\n"
-            "3",
-            reply_markup=back_button()
+            "1000\n"
+            "2",
+            reply_markup=BACK_BUTTON
         )
 
     elif query.data == "exchanges_brokers":
-        msg = (
-            "🔗 صرافی‌ها و بروکرهای ویژه:\n\n"
-            "1. [Binance](https://www.binance.com/)\n"
-            "2. [Bybit](https://www.bybit.com/)\n"
-            "3. [Deribit](https://www.deribit.com/)\n"
-            "4. [OKX](https://www.okx.com/)\n"
-            "5. [MEXC](https://www.mexc.com/)"
-        )
-        await query.edit_message_text(msg, parse_mode="Markdown", reply_markup=back_button())
+        await query.edit_message_text(EXCHANGES_TEXT, parse_mode="Markdown", reply_markup=BACK_BUTTON)
 
     elif query.data == "back_to_menu":
         context.user_data.clear()
         await query.edit_message_text(
-            "لطفا گزینه مورد نظر را انتخاب کنید:",
-            reply_markup=start_keyboard()
+            MENU_TEXT,
+            reply_markup=START_KEYBOARD
         )
 
     elif query.data == "cancel_broadcast":
-        context.user_data.pop('admin_broadcast_mode', None)
+        if isinstance(get_state(context), AdminBroadcastInput):
+            clear_state(context)
         await query.edit_message_text("❌ ارسال پیام لغو شد.")
 
     elif query.data.startswith(("verify_payment:", "reject_payment:")):
-        action, user_id = query.data.split(":")[0], int(query.data.split(":")[1])
-        pending = get_pending_verification(user_id)
+        if query.from_user.id != ADMIN_CHAT_ID:
+            return
+        # کلید یکتایی همان callback_data است؛ کلیک تکراری یا همزمان فقط نتیجه قبلی را می‌بیند
+        text, _ = await verification_actions.run(query.data, lambda: process_verification(context, query.data))
+        try:
+            await query.edit_message_text(text, reply_markup=None)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                raise
+    
+    elif query.data.startswith("pq:"):
+        if query.from_user.id != ADMIN_CHAT_ID:
+            return
+        await handle_pending_action(query, context)
 
-        if not pending:
-            await query.edit_message_text("❌ درخواست تأیید یافت نشد!")
+    elif query.data.startswith("users_page:"):
+        if query.from_user.id != ADMIN_CHAT_ID:
             return
 
-        if "verify" in action:
-            user_data = {
-                'user_id': pending[1],
-                'phone': pending[2],
-                'full_name': pending[3],
-                'nid': pending[4]
-            }
-            save_verified_user(user_data)
-            remove_pending_verification(user_id)
-
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="✅ پرداخت شما تایید شد! ثبت‌نام تکمیل گردید."
-            )
-            await query.edit_message_text(
-                f"✅ کاربر جدید ثبت شد:\n\n"
-                f"👤 نام: {user_data['full_name']}\n"
-                f"📞 تلفن: {user_data['phone']}\n"
-                f"🆔 آیدی: {user_id}\n"
-                f"📌 کد ملی: {user_data['nid']}\n"
-                f"🗓 تاریخ ثبت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                reply_markup=None
+        _, direction, cursor = query.data.split(":")
+        search = context.user_data.get('users_search')
+        if direction == "next":
+            users, has_prev, has_next = await db.get_verified_users_page(
+                USERS_PAGE_SIZE, after_id=int(cursor), search=search
             )
         else:
-            remove_pending_verification(user_id)
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="❌ پرداخت شما رد شد. لطفاً با پشتیبانی تماس بگیرید."
-            )
-            await query.edit_message_text(
-                f"❌ پرداخت کاربر رد شد.\n\n"
-                f"توسط ادمین در تاریخ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} انجام شد",
-                reply_markup=None
+            users, has_prev, has_next = await db.get_verified_users_page(
+                USERS_PAGE_SIZE, before_id=int(cursor), search=search
             )
-    
-    elif query.data.startswith("capital_percent:"):
-        parts = query.data.split(":")
-        percent = float(parts[1])
-        leverage = float(parts[2])
-        
-        context.user_data['capital_percent'] = percent
-        context.user_data['leverage'] = leverage
-        context.user_data['awaiting_capital'] = True
-        context.user_data['signal_message'] = query.message.text_html  # ذخیره متن اصلی سیگنال
-        
+
+        if not users:
+            await query.edit_message_text("❌ کاربری در این صفحه وجود ندارد.")
+            return
+
+        message, keyboard = format_users_page(users, has_prev, has_next, search)
+        await query.edit_message_text(message, reply_markup=keyboard)
+
+    elif query.data.startswith("cp:"):
+        _, signal_id, percent = query.data.split(":")
+        percent = float(percent)
+        set_state(context, CapitalInput(percent=percent, signal_id=int(signal_id)))
+
         await query.edit_message_text(
             f"📊 شما درصد <b>{percent}%</b> سرمایه را انتخاب کردید.\n\n"
             "💰 لطفاً میزان سرمایه دلاری خود را وارد کنید:\n"
             "مثال: 1000",
             parse_mode="HTML",
-            reply_markup=back_button()
+            reply_markup=BACK_BUTTON
+        )
+
+    elif query.data.startswith("capital_percent:"):
+        # دکمه‌های سیگنال‌های قدیمی که اطلاعات سیگنال در آن‌ها ذخیره نشده است
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text="⚠️ این سیگنال قدیمی است و محاسبه برای آن امکان‌پذیر نیست.",
+            reply_markup=BACK_BUTTON
+        )
+
+async def handle_stop_loss_input(update: Update, context: ContextTypes.DEFAULT_TYPE, current, text):
+    try:
+        parts = [p.strip() for p in text.split("\n") if p.strip()]
+        if len(parts) < 2:
+            raise ValueError("Invalid input")
+
+        capital = float(parts[0])
+        loss = float(parts[1])
+        percent = (loss / capital) * 100
+        msg = (
+            f"📊 محاسبه حد ضرر:\n\n"
+            f"💰 سرمایه شما: {capital} دلار\n"
+            f"📉 ضرر مورد نظر: {loss} دلار\n"
+            f"📈 درصد ضرر: {percent:.2f}%"
+        )
+        context.user_data.clear()
+    except Exception as e:
+        logger.error(f"Error in stop loss calculation: {e}")
+        msg = "❌ لطفاً مقادیر را دقیقاً به این فرمت وارد کنید:\n20\n3"
+    await update.message.reply_text(msg, reply_markup=BACK_BUTTON)
+
+async def handle_risk_profile_input(update: Update, context: ContextTypes.DEFAULT_TYPE, current, text):
+    try:
+        parts = text.split()
+        if len(parts) < 2:
+            raise ValueError("Invalid input")
+
+        capital = to_decimal(parts[0])
+        percent = to_decimal(parts[1])
+        if percent > 100:
+            raise ValueError("Invalid percent")
+
+        await db.save_risk_profile(update.message.from_user.id, float(capital), float(percent))
+        context.user_data.clear()
+        await update.message.reply_text(
+            f"✅ پروفایل ریسک شما ثبت شد:\n\n"
+            f"💰 سرمایه: {capital} دلار\n"
+            f"📊 درصد هر معامله: {percent}%",
+            reply_markup=BACK_BUTTON
         )
+    except ValueError:
+        await update.message.reply_text("❌ لطفاً مقادیر را دقیقاً به این فرمت وارد کنید:\n1000\n2")
+
+async def handle_capital_input(update: Update, context: ContextTypes.DEFAULT_TYPE, current, text):
+    try:
+        capital = to_decimal(text)
+        signal = await get_signal(current.signal_id) if current.signal_id else None
+        if signal is None:
+            context.user_data.clear()
+            await update.message.reply_text("❌ سیگنال مورد نظر یافت نشد.", reply_markup=BACK_BUTTON)
+            return
+
+        percent = current.percent
+        leverage = signal.leverage
+        sizing = signal.table.size(capital, percent)
+
+        # نمایش اعداد با دقت بالا (8 رقم اعشار)
+        formatted_trade_amount = f"{sizing.exposure:.8f}"
+        formatted_loss_amount = f"{sizing.loss:.8f}"
+        
+        msg = (
+            f"📊 محاسبات سرمایه‌گذاری:\n\n"
+            f"💵 سرمایه شما: <b>{capital:.2f} دلار</b>\n"
+            f"📊 درصد انتخاب شده: <b>{percent}%</b>\n"
+            f"⚖️ اهرم: <b>{leverage}x</b>\n\n"
+            f"💳 میزان ورود سرمایه شما همراه با اعمال اهرم اعلام شده باید روی این مقدار دلار باشد: <b>{formatted_trade_amount} دلار</b>\n"
+            f"📉 ضرر دلاری در صورت استاپ خوردن: <b>{formatted_loss_amount} دلار</b>\n"
+            f"📈 سود دلاری در صورت رسیدن به حد سود: <b>{sizing.profit:.8f} دلار</b>\n"
+            f"⚖️ نسبت ریسک به ریوارد: <b>1:{sizing.rr:.2f}</b>\n"
+            f"💥 قیمت تقریبی لیکوئید: <b>{sizing.liquidation:.8f}</b>"
+        )
+        
+        context.user_data.clear()
+        await update.message.reply_text(msg, parse_mode="HTML", reply_markup=BACK_BUTTON)
+    except ValueError:
+        await update.message.reply_text("❌ لطفاً یک عدد معتبر وارد کنید (مثال: 1000)")
+    except Exception as e:
+        logger.error(f"Error in capital calculation: {e}")
+        await update.message.reply_text("❌ خطا در محاسبه سرمایه مورد نیاز")
+
+async def handle_registration_input(update: Update, context: ContextTypes.DEFAULT_TYPE, current, text):
+    if current.step != 'awaiting_name_nid':
+        return
+
+    parts = text.split()
+    if len(parts) >= 2:
+        current.full_name = ' '.join(parts[:-1])
+        current.nid = parts[-1]
+        current.step = 'awaiting_payment'
+        await update.message.reply_text(
+            "✅ اطلاعات شما ثبت شد.\nلطفاً عکس فیش واریزی را ارسال کنید:",
+            reply_markup=BACK_BUTTON
+        )
+    else:
+        await update.message.reply_text("❌ فرمت صحیح: نام و نام خانوادگی + کد ملی\nمثال: علی رضایی 1234567890")
+
+# هندلر متن برای هر نوع وضعیت گفتگو
+TEXT_STATE_HANDLERS = {
+    StopLossInput: handle_stop_loss_input,
+    CapitalInput: handle_capital_input,
+    RiskProfileInput: handle_risk_profile_input,
+    Registration: handle_registration_input,
+}
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
 
-    if update.message.from_user.id == ADMIN_CHAT_ID and context.user_data.get('admin_broadcast_mode'):
+    current = get_state(context)
+    if update.message.from_user.id == ADMIN_CHAT_ID and isinstance(current, AdminBroadcastInput):
         await admin_broadcast(update, context)
         return
 
@@ -622,168 +1258,290 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text == "🔙 بازگشت به منو":
         context.user_data.clear()
         await update.message.reply_text(
-            "لطفا گزینه مورد نظر را انتخاب کنید:",
-            reply_markup=start_keyboard()
+            MENU_TEXT,
+            reply_markup=START_KEYBOARD
         )
         return
 
-    if context.user_data.get('awaiting_stop_loss'):
-        try:
-            parts = [p.strip() for p in text.split("\n") if p.strip()]
-            if len(parts) < 2:
-                raise ValueError("Invalid input")
-                
-            capital = float(parts[0])
-            loss = float(parts[1])
-            percent = (loss / capital) * 100
-            msg = (
-                f"📊 محاسبه حد ضرر:\n\n"
-                f"💰 سرمایه شما: {capital} دلار\n"
-                f"📉 ضرر مورد نظر: {loss} دلار\n"
-                f"📈 درصد ضرر: {percent:.2f}%"
-            )
-            context.user_data.clear()
-        except Exception as e:
-            logger.error(f"Error in stop loss calculation: {e}")
-            msg = "❌ لطفاً مقادیر را دقیقاً به این فرمت وارد کنید:\n20\n3"
-        await update.message.reply_text(msg, reply_markup=back_button())
-    
-    elif context.user_data.get('awaiting_capital'):
-        try:
-            capital = float(text)
-            percent = context.user_data['capital_percent']
-            leverage = context.user_data['leverage']
-            
-            trade_amount = calculate_trade_amount(capital, percent, leverage)
-            
-            # دریافت اطلاعات سیگنال از پیام اصلی
-            original_message = context.user_data.get('signal_message')
-            if original_message:
-                # استخراج entry و sl از پیام سیگنال
-                entry = None
-                sl = None
-                for line in original_message.split('\n'):
-                    if 'قیمت ورود' in line:
-                        entry = line.split('<b>')[1].split('</b>')[0].strip()
-                    elif 'حد ضرر' in line:
-                        sl = line.split('<b>')[1].split('</b>')[0].strip()
-                
-                if entry and sl:
-                    loss_amount = calculate_loss_amount(trade_amount, entry, sl)
-                else:
-                    loss_amount = 0
-            else:
-                loss_amount = 0
-            
-            # نمایش اعداد با دقت بالا (8 رقم اعشار)
-            formatted_trade_amount = f"{trade_amount:.8f}"
-            formatted_loss_amount = f"{loss_amount:.8f}"
-            
-            msg = (
-                f"📊 محاسبات سرمایه‌گذاری:\n\n"
-                f"💵 سرمایه شما: <b>{capital:.2f} دلار</b>\n"
-                f"📊 درصد انتخاب شده: <b>{percent}%</b>\n"
-                f"⚖️ اهرم: <b>{leverage}x</b>\n\n"
-                f"💳 میزان ورود سرمایه شما همراه با اعمال اهرم اعلام شده باید روی این مقدار دلار باشد: <b>{formatted_trade_amount} دلار</b>\n"
-                f"📉 ضرر دلاری در صورت استاپ خوردن: <b>{formatted_loss_amount} دلار</b>"
-            )
-            
-            context.user_data.clear()
-            await update.message.reply_text(msg, parse_mode="HTML", reply_markup=back_button())
-        except ValueError:
-            await update.message.reply_text("❌ لطفاً یک عدد معتبر وارد کنید (مثال: 1000)")
-        except Exception as e:
-            logger.error(f"Error in capital calculation: {e}")
-            await update.message.reply_text("❌ خطا در محاسبه سرمایه مورد نیاز")
-
-    elif context.user_data.get('registration_step') == 'awaiting_name_nid':
-        parts = text.split()
-        if len(parts) >= 2:
-            full_name = ' '.join(parts[:-1])
-            nid = parts[-1]
-            context.user_data['full_name'] = full_name
-            context.user_data['nid'] = nid
-            context.user_data['registration_step'] = 'awaiting_payment'
-            await update.message.reply_text(
-                "✅ اطلاعات شما ثبت شد.\nلطفاً عکس فیش واریزی را ارسال کنید:",
-                reply_markup=back_button()
-            )
-        else:
-            await update.message.reply_text("❌ فرمت صحیح: نام و نام خانوادگی + کد ملی\nمثال: علی رضایی 1234567890")
+    handler = TEXT_STATE_HANDLERS.get(type(current))
+    if handler:
+        await handler(update, context, current, text)
 
 async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     contact = update.message.contact
-    if context.user_data.get('registration_step') == 'awaiting_phone':
-        context.user_data['phone_number'] = contact.phone_number
-        context.user_data['user_id'] = contact.user_id
-        context.user_data['registration_step'] = 'awaiting_name_nid'
+    current = get_state(context)
+    if isinstance(current, Registration) and current.step == 'awaiting_phone':
+        if contact.user_id != update.effective_user.id:
+            await update.message.reply_text(
+                "⚠️ لطفاً شماره خودتان را با دکمه «📱 ارسال شماره» ارسال کنید.",
+                reply_markup=PHONE_REQUEST_KEYBOARD
+            )
+            return
+        current.phone = contact.phone_number
+        current.user_id = contact.user_id
+        current.step = 'awaiting_name_nid'
         await update.message.reply_text(
             "✅ شماره شما ثبت شد.\n\n"
             "لطفاً نام و نام خانوادگی و کد ملی خود را به این صورت وارد کنید:\n\n"
             "مثال:\nعلی رضایی 1234567890",
-            reply_markup=back_button()
+            reply_markup=BACK_BUTTON
         )
 
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('registration_step') == 'awaiting_payment':
-        file_id = update.message.photo[-1].file_id
-
-        user_data = {
-            'user_id': context.user_data['user_id'],
-            'phone': context.user_data['phone_number'],
-            'full_name': context.user_data['full_name'],
-            'nid': context.user_data['nid'],
-            'file_id': file_id
-        }
-        save_pending_verification(user_data)
+    current = get_state(context)
+    if isinstance(current, Registration) and current.step == 'awaiting_payment':
+        user_id = update.effective_user.id
+        if not receipt_collector.add(user_id, current, update.message.photo[-1]):
+            return
 
-        await update.message.reply_text(
-            "✅ فیش شما دریافت شد و در حال بررسی است.",
-            reply_markup=start_keyboard()
+        # عکس‌های آلبوم جداگانه می‌رسند؛ با هر عکس جدید بازه انتظار از نو شروع می‌شود
+        name = f"receipts:{user_id}"
+        for job in context.job_queue.get_jobs_by_name(name):
+            job.schedule_removal()
+        context.job_queue.run_once(
+            flush_receipts, RECEIPT_WINDOW, data=user_id, name=name, user_id=user_id, chat_id=user_id
         )
-        
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ تایید پرداخت", callback_data=f"verify_payment:{context.user_data['user_id']}")],
-            [InlineKeyboardButton("❌ رد پرداخت", callback_data=f"reject_payment:{context.user_data['user_id']}")]
-        ])
-        
+
+async def flush_receipts(context: ContextTypes.DEFAULT_TYPE):
+    """ثبت یکجای فیش‌های یک کاربر و ارسال یک پیام به ادمین"""
+    batch = receipt_collector.pop(context.job.data)
+    if batch is None:
+        return
+
+    # پایان مرحله پرداخت پیش از اولین await تا عکس بعدی هشدار دوباره برای ادمین نسازد
+    if isinstance(get_state(context), Registration):
+        clear_state(context)
+    request_id = await db.save_pending_verification(batch.to_pending())
+
+    count = len(batch.file_ids)
+    await context.bot.send_message(
+        chat_id=batch.user_id,
+        text="✅ فیش شما دریافت شد و در حال بررسی است." if count == 1 else
+             f"✅ {count} فیش شما دریافت شد و در حال بررسی است.",
+        reply_markup=START_KEYBOARD
+    )
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ تایید پرداخت", callback_data=f"verify_payment:{request_id}")],
+        [InlineKeyboardButton("❌ رد پرداخت", callback_data=f"reject_payment:{request_id}")]
+    ])
+    caption = (
+        "📌 درخواست ثبت‌نام جدید:\n\n"
+        f"👤 نام: {batch.full_name}\n"
+        f"🆔 کد ملی: {batch.nid}\n"
+        f"📞 شماره: {batch.phone}\n"
+        f"🆔 آیدی کاربر: {batch.user_id}"
+    )
+
+    if count == 1:
         await context.bot.send_photo(
             chat_id=ADMIN_CHAT_ID,
-            photo=file_id,
-            caption=(
-                "📌 درخواست ثبت‌نام جدید:\n\n"
-                f"👤 نام: {context.user_data['full_name']}\n"
-                f"🆔 کد ملی: {context.user_data['nid']}\n"
-                f"📞 شماره: {context.user_data['phone_number']}\n"
-                f"🆔 آیدی کاربر: {context.user_data['user_id']}"
-            ),
+            photo=batch.file_ids[0],
+            caption=caption,
             reply_markup=keyboard
         )
+        return
 
-def main() -> None:
-    start_keep_alive()
+    # آلبوم دکمه نمی‌پذیرد؛ مشخصات و دکمه‌ها در یک پیام جدا پس از عکس‌ها
+    for start in range(0, count, MEDIA_GROUP_LIMIT):
+        await context.bot.send_media_group(
+            chat_id=ADMIN_CHAT_ID,
+            media=[InputMediaPhoto(file_id) for file_id in batch.file_ids[start:start + MEDIA_GROUP_LIMIT]]
+        )
+    await context.bot.send_message(
+        chat_id=ADMIN_CHAT_ID,
+        text=f"{caption}\n🧾 تعداد فیش‌ها: {count}",
+        reply_markup=keyboard
+    )
 
-    web_thread = threading.Thread(target=run_web_server, daemon=True)
-    web_thread.start()
-    logger.info(f"🌐 سرور وب روی پورت {PORT} فعال شد")
-    
-    init_db()
-    
-    application = Application.builder().token(TOKEN).build()
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    health_monitor.mark_update()
+
+async def post_init(application: Application):
+    health_monitor.start(application)
+    await start_web_services()
+    await load_recipients()
+    application.job_queue.run_repeating(
+        check_recipients, RECIPIENT_CHECK_INTERVAL, first=RECIPIENT_CHECK_INTERVAL, name="check_recipients"
+    )
+    application.job_queue.run_repeating(prune_delivery_log, 24 * 3600, first=60, name="prune_delivery_log")
+    await resume_broadcast_jobs(application)
+    await start_signal_monitor(application)
 
+async def post_shutdown(application: Application):
+    await stop_signal_monitor()
+    await stop_web_services()
+    await health_monitor.stop()
+    db.close_all()
+
+async def run_webhook(application: Application):
+    """اجرای ربات با وب‌هوک روی سرور وب داخلی؛ در صورت خطا به polling برمی‌گردد"""
+    global webhook_application
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    try:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        webhook_application = application
+        health_monitor.webhook = True
+        logger.info(f"🔗 وب‌هوک روی {WEBHOOK_URL}{WEBHOOK_PATH} فعال شد")
+    except TelegramError as e:
+        logger.error(f"❌ خطا در تنظیم وب‌هوک، استفاده از polling: {e}")
+        await application.updater.start_polling()
+
+    await application.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+    webhook_application = None
+    if application.updater.running:
+        await application.updater.stop()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+def build_application(updater=True) -> Application:
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=TELEGRAM_POOL_SIZE))
+        .persistence(SQLitePersistence())
+        .concurrent_updates(OrderedUpdateProcessor(admin_ids=(ADMIN_CHAT_ID,)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+
+    application.add_handler(TypeHandler(Update, track_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin23", admin_broadcast))
     application.add_handler(CommandHandler("remove_user", remove_user))
     application.add_handler(CommandHandler("list_users", list_users))
+    application.add_handler(CommandHandler("pending", pending_queue))
     application.add_handler(CommandHandler("export", export_excel))
     application.add_handler(CommandHandler("send_signal", send_signal))
+    application.add_handler(CommandHandler("update_signal", update_signal))
+    application.add_handler(CommandHandler("close_signal", close_signal))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel))
+    application.add_handler(CommandHandler("delivery_report", delivery_report))
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
     application.add_handler(MessageHandler(filters.CONTACT, contact_handler))
     application.add_handler(MessageHandler(filters.PHOTO, photo_handler))
+    metrics.instrument_handlers(application)
+    return application
+
+# --- اجرای چندپروسه‌ای ---
+shard_router = None
+
+async def ingress_post_init(application: Application):
+    health_monitor.start(application)
+    await start_web_services()
+    shard_router.start()
+    health_monitor.workers = shard_router.status
+    application.job_queue.run_repeating(check_workers, sharding.WORKER_CHECK_INTERVAL, name="check_workers")
+
+async def check_workers(context: ContextTypes.DEFAULT_TYPE):
+    shard_router.check()
+    shard_router.collect()
+
+async def ingress_post_shutdown(application: Application):
+    await shard_router.stop()
+    await stop_web_services()
+    await health_monitor.stop()
+    db.close_all()
+
+def build_ingress_application() -> Application:
+    """پروسه ورودی: فقط دریافت آپدیت و ارسال آن به کارگر مربوط"""
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=TELEGRAM_POOL_SIZE))
+        .post_init(ingress_post_init)
+        .post_shutdown(ingress_post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, track_update), group=-2)
+    application.add_handler(TypeHandler(Update, shard_router.forward), group=-1)
+    return application
+
+async def push_worker_metrics(context: ContextTypes.DEFAULT_TYPE):
+    index, stats = context.job.data
+    if index == 0:
+        recipients_gauge.set(len(recipient_cache))
+    sharding.report_metrics(stats, index)
+
+async def serve_worker(index, queue, stats):
+    # معیارها فقط برای نمایش‌اند؛ پروسه نباید برای خالی شدن این صف منتظر بماند
+    stats.cancel_join_thread()
+    application = build_application(updater=False)
+    await application.initialize()
+    await load_recipients()
+    application.job_queue.run_repeating(
+        check_recipients, RECIPIENT_CHECK_INTERVAL, first=RECIPIENT_CHECK_INTERVAL, name="check_recipients"
+    )
+    application.job_queue.run_repeating(
+        push_worker_metrics, sharding.METRICS_INTERVAL, first=1, data=(index, stats), name="push_metrics"
+    )
+    await application.start()
+    # کارهای زمان‌بندی شده فقط در کارگر ۰ (که آپدیت‌های ادمین هم به آن می‌رسد)
+    if index == 0:
+        application.job_queue.run_repeating(prune_delivery_log, 24 * 3600, first=60, name="prune_delivery_log")
+        await resume_broadcast_jobs(application)
+        await start_signal_monitor(application)
+    logger.info(f"🧩 کارگر {index} آماده است")
 
-    logger.info("✅ ربات تلگرام در حال اجراست...")
-    application.run_polling()
+    try:
+        await sharding.consume(queue, application)
+    finally:
+        await stop_signal_monitor()
+        await application.stop()
+        await application.shutdown()
+        sharding.shutdown_cpu_pool()
+        db.close_all()
+
+def run_worker(index, workers, queue, stats):
+    """نقطه شروع پروسه کارگر"""
+    # توقف با پیام پایان از پروسه ورودی انجام می‌شود، نه با Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_worker(index, queue, stats))
+
+def main() -> None:
+    global shard_router
+    db.init_db()
+
+    if sharding.WORKERS > 1:
+        shard_router = sharding.ShardRouter(run_worker, sharding.WORKERS, admin_ids=(ADMIN_CHAT_ID,))
+        application = build_ingress_application()
+        logger.info(f"✅ ربات تلگرام با {sharding.WORKERS} پروسه کارگر در حال اجراست...")
+    else:
+        application = build_application()
+        logger.info("✅ ربات تلگرام در حال اجراست...")
+
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""موتور ارسال همگانی با محدودیت نرخ برای پیام‌های ربات"""
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# محدودیت‌های تلگرام: حدود ۳۰ پیام در ثانیه در کل و یک پیام در ثانیه برای هر چت
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+MAX_CONCURRENCY = 30
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+MAX_RETRY_AFTER_ROUNDS = 5
+
+# دسته‌بندی خطاهای تحویل؛ دو مورد اول دائمی‌اند و گیرنده غیرفعال می‌شود
+BLOCKED = 'blocked'
+NOT_FOUND = 'not_found'
+RATE_LIMITED = 'rate_limited'
+NETWORK = 'network'
+OTHER = 'other'
+PERMANENT_FAILURES = frozenset((BLOCKED, NOT_FOUND))
+NOT_FOUND_ERRORS = ('chat not found', 'user not found', 'user is deactivated', 'peer_id_invalid')
+
+
+def classify(error):
+    """دسته خطای تحویل برای گزارش و تصمیم به حذف گیرنده"""
+    if isinstance(error, Forbidden):
+        return BLOCKED
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        if any(text in message for text in NOT_FOUND_ERRORS):
+            return NOT_FOUND
+        return OTHER
+    if isinstance(error, RetryAfter):
+        return RATE_LIMITED
+    if isinstance(error, NetworkError):
+        return NETWORK
+    return OTHER
+
+
+class RateLimiter:
+    """سطل توکن سراسری به همراه فاصله‌ی حداقلی برای هر چت"""
+
+    def __init__(self, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.capacity = rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._chat_next = {}
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """توقف سراسری ارسال (برای خطای RetryAfter)"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            logger.warning(f"⏸ توقف سراسری ارسال به مدت {seconds} ثانیه")
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        next_allowed = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, next_allowed) + self.per_chat_interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+    async def acquire(self, chat_id=None):
+        if chat_id is not None:
+            await self._wait_chat(chat_id)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# یک محدودکننده‌ی مشترک برای کل پروسه تا ارسال‌های همزمان از سقف تلگرام عبور نکنند
+limiter = RateLimiter()
+
+
+class BroadcastStats:
+    """آمار یک ارسال همگانی: موفق/ناموفق، توان عملیاتی و تأخیر تحویل"""
+
+    def __init__(self, total=0):
+        self.total = total
+        self.success = 0
+        self.failed = 0
+        # گیرندگانی که نیازی به ارسال نداشتند (مثلاً ویرایش بدون تغییر متن)
+        self.skipped = 0
+        self.errors = Counter()
+        self.latencies = []
+        # ارسال‌های موفق و خطاهای (آیدی چت، دسته خطا، متن خطا) تا ثبت در گزارش تحویل
+        self.delivered = 0
+        self.failures = []
+        self.per_second = Counter()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, ok, error=None, chat_id=None):
+        now = time.monotonic()
+        self.per_second[int(now - self.started)] += 1
+        if ok:
+            self.success += 1
+            self.delivered += 1
+            self.latencies.append(now - self.started)
+        else:
+            self.failed += 1
+            self.errors[type(error).__name__] += 1
+            if chat_id is not None:
+                self.failures.append((chat_id, classify(error), str(error)[:200]))
+
+    def drain(self):
+        """
+        برداشتن نتایج ثبت نشده در گزارش تحویل
+
+        خروجی: (تعداد ارسال موفق، خطاها، آیدی گیرندگان از دست رفته). گیرندگان رد شده
+        (skip) ارسالی نداشته‌اند و در گزارش نمی‌آیند.
+        """
+        delivered, self.delivered = self.delivered, 0
+        failures, self.failures = self.failures, []
+        dead = [chat_id for chat_id, status, _ in failures if status in PERMANENT_FAILURES]
+        return delivered, failures, dead
+
+    def skip(self, count):
+        """ثبت گیرندگان رد شده به عنوان تحویل موفق بدون فراخوانی API"""
+        self.success += count
+        self.skipped += count
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        return (self.success - self.skipped + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self):
+        peak = max(self.per_second.values(), default=0)
+        lines = [
+            f"⏱ مدت ارسال: {self.elapsed:.1f} ثانیه",
+            f"🚀 توان ارسال: {self.throughput:.1f} پیام در ثانیه (حداکثر {peak})",
+            f"📬 تأخیر تحویل p50: {self.percentile(50):.2f}s | p99: {self.percentile(99):.2f}s",
+        ]
+        if self.skipped:
+            lines.append(f"⏭ بدون تغییر (ارسال نشد): {self.skipped}")
+        if self.errors:
+            lines.append("⚠️ خطاها: " + "، ".join(f"{name}×{count}" for name, count in self.errors.most_common()))
+        return "\n".join(lines)
+
+
+async def _deliver(chat_id, send, rate_limiter):
+    """ارسال به یک چت با رعایت RetryAfter و تلاش مجدد برای خطاهای شبکه"""
+    attempt = 0
+    retry_after_rounds = 0
+    while True:
+        await rate_limiter.acquire(chat_id)
+        try:
+            return await send(chat_id)
+        except RetryAfter as e:
+            retry_after_rounds += 1
+            rate_limiter.pause(float(e.retry_after))
+            if retry_after_rounds > MAX_RETRY_AFTER_ROUNDS:
+                raise
+        except BadRequest:
+            raise
+        except NetworkError:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            await asyncio.sleep(BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+async def fan_out(chat_ids, send, concurrency=MAX_CONCURRENCY, stats=None, rate_limiter=None):
+    """
+    ارسال موازی به لیست چت‌ها
+
+    `send` یک تابع async است که آیدی چت را می‌گیرد و پیام را ارسال می‌کند.
+    """
+    chat_ids = list(chat_ids)
+    if stats is None:
+        stats = BroadcastStats(len(chat_ids))
+    rate_limiter = rate_limiter or limiter
+    pending = iter(chat_ids)
+
+    async def worker():
+        for chat_id in pending:
+            try:
+                await _deliver(chat_id, send, rate_limiter)
+                stats.record(True)
+            except TelegramError as e:
+                logger.error(f"Error sending to {chat_id}: {e}")
+                stats.record(False, e, chat_id)
+                metrics.send_errors.inc(type(e).__name__)
+            except Exception as e:
+                logger.error(f"Unexpected error sending to {chat_id}: {e}")
+                stats.record(False, e, chat_id)
+                metrics.send_errors.inc(type(e).__name__)
+
+    workers = min(concurrency, len(chat_ids))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    stats.finished = time.monotonic()
+    return stats
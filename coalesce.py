@@ -0,0 +1,40 @@
+"""اجرای یک‌باره عملیات به ازای هر کلید (idempotency) با ادغام درخواست‌های همزمان"""
+import asyncio
+from collections import OrderedDict
+
+# تعداد نتیجه‌های نگه داشته شده برای پاسخ به درخواست‌های تکراری
+RESULT_CACHE_SIZE = 1024
+
+
+class Coalescer:
+    """
+    اولین درخواست هر کلید اجرا می‌شود؛ درخواست‌های همزمان منتظر همان اجرا می‌مانند
+    و درخواست‌های بعدی نتیجه را از کش می‌گیرند. در صورت خطا کلید آزاد می‌شود تا
+    تلاش دوباره ممکن باشد.
+    """
+
+    def __init__(self, size=RESULT_CACHE_SIZE):
+        self.size = size
+        self._results = OrderedDict()
+
+    async def run(self, key, func):
+        """خروجی: (نتیجه، آیا تکراری بود)"""
+        future = self._results.get(key)
+        if future is not None:
+            self._results.move_to_end(key)
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._results[key] = future
+        if len(self._results) > self.size:
+            self._results.popitem(last=False)
+        try:
+            result = await func()
+        except BaseException as e:
+            self._results.pop(key, None)
+            future.set_exception(e)
+            # جلوگیری از هشدار «exception was never retrieved» وقتی منتظری نیست
+            future.exception()
+            raise
+        future.set_result(result)
+        return result, False
@@ -0,0 +1,769 @@
+"""لایه دسترسی به دیتابیس با اتصال‌های ماندگار، حالت WAL و اجرای غیرمسدودکننده"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import metrics
+from recipients import cache as recipient_cache
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = os.environ.get('DB_NAME', 'bot_data.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_TIMEOUT = 30
+STATEMENT_CACHE_SIZE = 256
+# سقف پارامترهای یک کوئری در SQLite
+MAX_QUERY_PARAMS = 900
+
+# هر ترد این استخر یک اتصال ماندگار دارد؛ در عمل یک استخر اتصال با اندازه DB_POOL_SIZE
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_connection():
+    """اتصال ماندگار ترد جاری (در اولین استفاده ساخته می‌شود)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_NAME,
+            timeout=DB_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_TIMEOUT * 1000}')
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+@contextmanager
+def transaction(immediate=False):
+    """تراکنش صریح؛ با immediate قفل نوشتن از ابتدا گرفته می‌شود"""
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _select_in(conn, query, values):
+    """اجرای کوئری با `IN ({})` برای لیست بلند مقادیر در چند تکه"""
+    values = list(values)
+    rows = []
+    for start in range(0, len(values), MAX_QUERY_PARAMS):
+        chunk = values[start:start + MAX_QUERY_PARAMS]
+        rows += conn.execute(query.format(','.join('?' * len(chunk))), chunk).fetchall()
+    return rows
+
+
+def close_all():
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    _local.__dict__.clear()
+
+
+def threaded(func):
+    """اجرای تابع دیتابیس در استخر ترد دیتابیس تا حلقه رویداد مسدود نشود"""
+    @metrics.instrument(func.__name__, metrics.db_calls, metrics.db_seconds, metrics.db_in_flight)
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+    return wrapper
+
+
+# --- ساختار جداول و مهاجرت‌ها ---
+# هر مهاجرت فقط یک بار اجرا می‌شود و شماره آن در PRAGMA user_version ذخیره می‌شود.
+# مهاجرت‌ها نباید جدول را بازسازی کنند تا راه‌اندازی مجدد سریع بماند.
+MIGRATIONS = [
+    # 1: جداول پایه (برای دیتابیس‌های قدیمی بدون تغییر اجرا می‌شود)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS verified_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            phone TEXT,
+            full_name TEXT,
+            nid TEXT,
+            registration_date TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS pending_verification (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            phone TEXT,
+            full_name TEXT,
+            nid TEXT,
+            file_id TEXT,
+            date TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            payload TEXT,
+            status TEXT,
+            last_user_id INTEGER DEFAULT 0,
+            success INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at TEXT,
+            updated_at TEXT
+        )
+        ''',
+    ],
+    # 2: ایندکس‌ها و یکتا بودن درخواست در انتظار برای هر کاربر
+    [
+        # فقط جدیدترین درخواست هر کاربر نگه داشته می‌شود
+        '''
+        DELETE FROM pending_verification
+        WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM pending_verification GROUP BY user_id
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_pending_user_id ON pending_verification (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_pending_date ON pending_verification (date)',
+        'CREATE INDEX IF NOT EXISTS idx_verified_registration_date ON verified_users (registration_date)',
+        'CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)',
+    ],
+    # 3: ایندکس‌های جستجوی کاربران
+    [
+        'CREATE INDEX IF NOT EXISTS idx_verified_full_name ON verified_users (full_name)',
+        'CREATE INDEX IF NOT EXISTS idx_verified_phone ON verified_users (phone)',
+        'CREATE INDEX IF NOT EXISTS idx_verified_nid ON verified_users (nid)',
+    ],
+    # 4: وضعیت گفتگوی کاربران
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT,
+            updated_at TEXT
+        )
+        ''',
+    ],
+    # 5: سیگنال‌های ارسال شده
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS signals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entry TEXT,
+            sl TEXT,
+            tp TEXT,
+            leverage TEXT,
+            created_at TEXT
+        )
+        ''',
+    ],
+    # 6: نماد و وضعیت سیگنال برای پایش قیمت
+    [
+        'ALTER TABLE signals ADD COLUMN symbol TEXT',
+        "ALTER TABLE signals ADD COLUMN status TEXT DEFAULT 'open'",
+        'CREATE INDEX IF NOT EXISTS idx_signals_status ON signals (status)',
+    ],
+    # 7: پروفایل ریسک کاربران
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS risk_profiles (
+            user_id INTEGER PRIMARY KEY,
+            capital REAL NOT NULL,
+            risk_percent REAL NOT NULL,
+            updated_at TEXT
+        )
+        ''',
+    ],
+    # 8: چند فیش برای هر درخواست (لیست JSON؛ file_id همان فیش اول است)
+    [
+        'ALTER TABLE pending_verification ADD COLUMN file_ids TEXT',
+    ],
+    # 9: گزارش خطای تحویل و غیرفعال کردن گیرندگان از دست رفته
+    [
+        'ALTER TABLE verified_users ADD COLUMN active INTEGER NOT NULL DEFAULT 1',
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            user_id INTEGER,
+            status TEXT,
+            error TEXT,
+            created_at TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_delivery_log_created_at ON delivery_log (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_verified_active ON verified_users (active, user_id)',
+    ],
+    # 10: پیام‌های ارسال شده هر سیگنال برای ویرایش بعدی (بدون rowid برای حجم کمتر)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS signal_messages (
+            signal_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            content_hash INTEGER,
+            PRIMARY KEY (signal_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 11: تعداد ارسال موفق هر دسته در همان جدول گزارش تحویل
+    [
+        'ALTER TABLE delivery_log ADD COLUMN count INTEGER NOT NULL DEFAULT 1',
+    ],
+    # 12: نسخه سیگنال تا workerها تغییر حد ضرر/سود را در کش خود تشخیص دهند
+    [
+        'ALTER TABLE signals ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    ],
+]
+
+
+def migrate(conn):
+    """اجرای مهاجرت‌های اجرا نشده به ترتیب"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        logger.info(f"🗄 مهاجرت دیتابیس به نسخه {number} انجام شد")
+
+
+def init_db():
+    migrate(get_connection())
+
+
+@threaded
+def ping():
+    return get_connection().execute('SELECT 1').fetchone()[0]
+
+
+# --- کاربران تایید شده ---
+# بزرگ‌ترین کاراکتر ممکن؛ برای تبدیل جستجوی پیشوندی به بازه قابل استفاده با ایندکس
+_PREFIX_END = '\U0010ffff'
+
+
+# بزرگ‌ترین عدد قابل ذخیره در ستون INTEGER در SQLite
+_MAX_INTEGER = 2 ** 63 - 1
+
+
+def _search_clause(search):
+    """شرط جستجوی عددی (آیدی، پیشوند تلفن یا کد ملی) که با MULTI-INDEX OR اجرا می‌شود"""
+    upper = search + _PREFIX_END
+    prefixes = '(phone >= ? AND phone < ?) OR (nid >= ? AND nid < ?)'
+    user_id = int(search.lstrip('+'))
+    # عدد بزرگ‌تر از INTEGER نمی‌تواند آیدی باشد و bind آن OverflowError می‌دهد
+    if user_id > _MAX_INTEGER:
+        return f' AND ({prefixes})', (search, upper, search, upper)
+    return f' AND (user_id = ? OR {prefixes})', (user_id, search, upper, search, upper)
+
+
+def _name_page(conn, limit, after_id, before_id, search):
+    """
+    صفحه‌بندی جستجوی نام روی (full_name, id)
+
+    ترتیب ایندکس idx_verified_full_name همین است (id همان rowid است)، پس هر صفحه یک
+    SEARCH روی ایندکس است بدون مرتب‌سازی نتایج. نشانگر صفحه همچنان id است و نام آن
+    ردیف از جدول خوانده می‌شود.
+    """
+    lower, upper = search, search + _PREFIX_END
+    cursor_id = before_id if before_id is not None else after_id
+    cursor = conn.execute('SELECT full_name FROM verified_users WHERE id = ?', (cursor_id,)).fetchone()
+    if before_id is not None and cursor:
+        rows = conn.execute(
+            'SELECT * FROM verified_users WHERE (full_name, id) < (?, ?) AND full_name >= ? '
+            'ORDER BY full_name DESC, id DESC LIMIT ?',
+            (cursor[0], before_id, lower, limit + 1)
+        ).fetchall()
+        return rows[:limit][::-1], len(rows) > limit, True
+
+    if cursor:
+        rows = conn.execute(
+            'SELECT * FROM verified_users WHERE (full_name, id) > (?, ?) AND full_name < ? '
+            'ORDER BY full_name, id LIMIT ?',
+            (cursor[0], after_id, upper, limit + 1)
+        ).fetchall()
+    else:
+        # صفحه اول (یا ردیف نشانگر حذف شده است)
+        rows = conn.execute(
+            'SELECT * FROM verified_users WHERE full_name >= ? AND full_name < ? '
+            'ORDER BY full_name, id LIMIT ?',
+            (lower, upper, limit + 1)
+        ).fetchall()
+    return rows[:limit], cursor is not None, len(rows) > limit
+
+
+@threaded
+def get_verified_users_page(limit, after_id=0, before_id=None, search=None):
+    """
+    صفحه‌بندی کلیدی (keyset)
+
+    برای صفحه بعد after_id و برای صفحه قبل before_id (آیدی ردیف اول/آخر صفحه فعلی)
+    داده می‌شود. یک ردیف بیشتر از limit خوانده می‌شود تا وجود صفحه بعدی/قبلی مشخص شود.
+    بدون جستجو ترتیب بر اساس id است، در جستجوی نام بر اساس (full_name, id) و در
+    جستجوی عددی بر اساس id روی ردیف‌های پیدا شده (‎+id تا برنامه‌ریز به جای ایندکس‌ها
+    کل جدول را به ترتیب rowid پیمایش نکند).
+    خروجی: (ردیف‌ها، آیا صفحه قبلی هست، آیا صفحه بعدی هست)
+    """
+    conn = get_connection()
+    if search and not search.lstrip('+').isdigit():
+        return _name_page(conn, limit, after_id, before_id, search)
+
+    clause, params = _search_clause(search) if search else ('', ())
+    id_column = '+id' if search else 'id'
+    if before_id is not None:
+        rows = conn.execute(
+            f'SELECT * FROM verified_users WHERE {id_column} < ?{clause} ORDER BY id DESC LIMIT ?',
+            (before_id, *params, limit + 1)
+        ).fetchall()
+        has_prev = len(rows) > limit
+        return rows[:limit][::-1], has_prev, True
+
+    rows = conn.execute(
+        f'SELECT * FROM verified_users WHERE {id_column} > ?{clause} ORDER BY id LIMIT ?',
+        (after_id, *params, limit + 1)
+    ).fetchall()
+    return rows[:limit], after_id > 0, len(rows) > limit
+
+
+def iter_verified_users(chunk_size):
+    """پیمایش دسته‌ای کاربران بدون بارگذاری کل جدول در حافظه (همگام، برای ترد خروجی)"""
+    cur = get_connection().execute('SELECT * FROM verified_users ORDER BY id')
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+@threaded
+def remove_verified_user(user_id):
+    """حذف کاربر و بازگرداندن ردیف حذف شده (یا None)"""
+    with transaction(immediate=True) as conn:
+        user = conn.execute('SELECT * FROM verified_users WHERE user_id = ?', (user_id,)).fetchone()
+        if user:
+            conn.execute('DELETE FROM verified_users WHERE user_id = ?', (user_id,))
+    if user:
+        recipient_cache.discard(user[1])
+    return user
+
+
+@threaded
+def get_verified_user_ids():
+    """گیرندگان فعال (کاربرانی که ربات را مسدود نکرده‌اند)"""
+    return [row[0] for row in get_connection().execute('SELECT user_id FROM verified_users WHERE active = 1')]
+
+
+@threaded
+def get_verified_users_fingerprint():
+    """(تعداد، مجموع آیدی‌ها) گیرندگان فعال برای بررسی هماهنگی کش گیرندگان"""
+    count, total = get_connection().execute(
+        'SELECT COUNT(*), COALESCE(SUM(user_id), 0) FROM verified_users WHERE active = 1'
+    ).fetchone()
+    return count, total
+
+
+@threaded
+def reactivate_user(user_id):
+    """فعال کردن دوباره کاربر غیرفعال (مثلاً پس از /start)؛ خروجی: آیا تغییری انجام شد"""
+    cur = get_connection().execute(
+        'UPDATE verified_users SET active = 1 WHERE user_id = ? AND active = 0', (user_id,)
+    )
+    if cur.rowcount:
+        recipient_cache.add(user_id)
+    return bool(cur.rowcount)
+
+
+@threaded
+def get_recipient_counts():
+    """(فعال، غیرفعال)"""
+    active, inactive = get_connection().execute(
+        'SELECT COALESCE(SUM(active = 1), 0), COALESCE(SUM(active = 0), 0) FROM verified_users'
+    ).fetchone()
+    return active, inactive
+
+
+# --- درخواست‌های در انتظار تایید ---
+@threaded
+def save_pending_verification(user_data):
+    """
+    ثبت درخواست تایید؛ خروجی شناسه این درخواست
+
+    هر ارسال شناسه تازه می‌گیرد (حتی اگر درخواست قبلی کاربر جایگزین شود) تا دکمه‌های
+    ادمین به همین درخواست مشخص اشاره کنند، نه به کاربر.
+    """
+    request_id = str(uuid.uuid4())
+    get_connection().execute('''
+    INSERT INTO pending_verification
+    (id, user_id, phone, full_name, nid, file_id, date, file_ids)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        id = excluded.id,
+        phone = excluded.phone,
+        full_name = excluded.full_name,
+        nid = excluded.nid,
+        file_id = excluded.file_id,
+        date = excluded.date,
+        file_ids = excluded.file_ids
+    ''', (
+        request_id,
+        user_data['user_id'],
+        user_data['phone'],
+        user_data['full_name'],
+        user_data['nid'],
+        user_data['file_ids'][0],
+        _now(),
+        json.dumps(user_data['file_ids'])
+    ))
+    return request_id
+
+
+@threaded
+def get_pending_page(limit, offset=0):
+    """صفحه‌ای از درخواست‌ها به ترتیب تاریخ؛ خروجی: (ردیف‌ها، تعداد کل)"""
+    conn = get_connection()
+    rows = conn.execute(
+        'SELECT user_id, phone, full_name, nid, date FROM pending_verification '
+        'ORDER BY date, user_id LIMIT ? OFFSET ?',
+        (limit, offset)
+    ).fetchall()
+    total = conn.execute('SELECT COUNT(*) FROM pending_verification').fetchone()[0]
+    return rows, total
+
+
+@threaded
+def verify_pending_users(user_ids):
+    """
+    تایید گروهی درخواست‌ها در یک تراکنش
+
+    فقط درخواست‌هایی که هنوز وجود دارند منتقل می‌شوند؛ خروجی ردیف‌های
+    (user_id, phone, full_name, nid) تایید شده است.
+    """
+    with transaction(immediate=True) as conn:
+        rows = _select_in(
+            conn, 'SELECT user_id, phone, full_name, nid FROM pending_verification WHERE user_id IN ({})', user_ids
+        )
+        _move_to_verified(conn, rows)
+    for row in rows:
+        recipient_cache.add(row[0])
+    return rows
+
+
+@threaded
+def verify_pending_request(request_id):
+    """تایید یک درخواست مشخص با شناسه آن؛ خروجی (user_id, phone, full_name, nid) یا None"""
+    with transaction(immediate=True) as conn:
+        rows = conn.execute(
+            'SELECT user_id, phone, full_name, nid FROM pending_verification WHERE id = ?', (request_id,)
+        ).fetchall()
+        _move_to_verified(conn, rows)
+    for row in rows:
+        recipient_cache.add(row[0])
+    return rows[0] if rows else None
+
+
+def _move_to_verified(conn, rows):
+    now = _now()
+    conn.executemany(
+        '''
+        INSERT OR REPLACE INTO verified_users
+        (user_id, phone, full_name, nid, registration_date)
+        VALUES (?, ?, ?, ?, ?)
+        ''',
+        [(*row, now) for row in rows]
+    )
+    conn.executemany(
+        'DELETE FROM pending_verification WHERE user_id = ?', [(row[0],) for row in rows]
+    )
+
+
+@threaded
+def reject_pending_users(user_ids):
+    """رد گروهی درخواست‌ها در یک تراکنش؛ خروجی آیدی کاربرانی که درخواستشان حذف شد"""
+    with transaction(immediate=True) as conn:
+        rows = _select_in(conn, 'SELECT user_id FROM pending_verification WHERE user_id IN ({})', user_ids)
+        conn.executemany('DELETE FROM pending_verification WHERE user_id = ?', rows)
+    return [row[0] for row in rows]
+
+
+@threaded
+def reject_pending_request(request_id):
+    """رد یک درخواست مشخص با شناسه آن؛ خروجی آیدی کاربر یا None"""
+    with transaction(immediate=True) as conn:
+        row = conn.execute('SELECT user_id FROM pending_verification WHERE id = ?', (request_id,)).fetchone()
+        if row:
+            conn.execute('DELETE FROM pending_verification WHERE id = ?', (request_id,))
+    return row[0] if row else None
+
+
+# --- کارهای ارسال همگانی ---
+@threaded
+def create_broadcast_job(kind, payload, chat_id, total):
+    now = _now()
+    cur = get_connection().execute('''
+    INSERT INTO broadcast_jobs
+    (kind, payload, status, total, chat_id, created_at, updated_at)
+    VALUES (?, ?, 'queued', ?, ?, ?, ?)
+    ''', (kind, json.dumps(payload), total, chat_id, now, now))
+    return cur.lastrowid
+
+
+@threaded
+def get_broadcast_job(job_id):
+    cur = get_connection().execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return dict(zip((column[0] for column in cur.description), row))
+
+
+@threaded
+def update_broadcast_job(job_id, **fields):
+    fields['updated_at'] = _now()
+    columns = ', '.join(f"{name} = ?" for name in fields)
+    get_connection().execute(
+        f'UPDATE broadcast_jobs SET {columns} WHERE id = ?', (*fields.values(), job_id)
+    )
+
+
+@threaded
+def get_broadcast_backlog():
+    """(تعداد کارهای ناتمام، تعداد پیام‌های باقی‌مانده)"""
+    jobs, messages = get_connection().execute('''
+    SELECT COUNT(*), COALESCE(SUM(MAX(total - success - failed, 0)), 0)
+    FROM broadcast_jobs WHERE status IN ('queued', 'running')
+    ''').fetchone()
+    return jobs, messages
+
+
+@threaded
+def get_unfinished_broadcast_jobs():
+    rows = get_connection().execute(
+        "SELECT id FROM broadcast_jobs WHERE status IN ('queued', 'running') ORDER BY id"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+# --- گزارش تحویل ---
+@threaded
+def log_deliveries(job_id, delivered, failures, inactive_ids=()):
+    """
+    ثبت دسته‌ای نتیجه تحویل و غیرفعال کردن گیرندگان از دست رفته در یک تراکنش
+
+    ارسال‌های موفق یک ردیف delivered با تعداد آن‌هاست و هر خطا یک ردیف
+    (failures لیست (user_id, وضعیت، متن خطا) است).
+    """
+    now = _now()
+    with transaction() as conn:
+        if delivered:
+            conn.execute(
+                "INSERT INTO delivery_log (job_id, status, count, created_at) VALUES (?, 'delivered', ?, ?)",
+                (job_id, delivered, now)
+            )
+        conn.executemany(
+            'INSERT INTO delivery_log (job_id, user_id, status, error, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(job_id, user_id, status, error, now) for user_id, status, error in failures]
+        )
+        conn.executemany(
+            'UPDATE verified_users SET active = 0 WHERE user_id = ?', [(user_id,) for user_id in inactive_ids]
+        )
+    for user_id in inactive_ids:
+        recipient_cache.discard(user_id)
+
+
+@threaded
+def get_delivery_report(days):
+    """
+    وضعیت تحویل روزانه از delivery_log (ارسال‌های همگانی و اطلاع‌رسانی‌ها)
+
+    خروجی: لیست (روز، پیام موفق، {وضعیت خطا: تعداد}) از جدید به قدیم.
+    """
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    report = {}
+    for day, status, count in get_connection().execute(
+        'SELECT substr(created_at, 1, 10), status, SUM(count) FROM delivery_log '
+        'WHERE created_at >= ? GROUP BY 1, 2', (since,)
+    ):
+        entry = report.setdefault(day, [0, {}])
+        if status == 'delivered':
+            entry[0] = count
+        else:
+            entry[1][status] = count
+    return [(day, success, failures) for day, (success, failures) in sorted(report.items(), reverse=True)]
+
+
+@threaded
+def prune_delivery_log(days):
+    before = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    return get_connection().execute('DELETE FROM delivery_log WHERE created_at < ?', (before,)).rowcount
+
+
+# --- سیگنال‌ها ---
+@threaded
+def create_signal(entry, sl, tp, leverage, symbol=None):
+    cur = get_connection().execute(
+        'INSERT INTO signals (entry, sl, tp, leverage, created_at, symbol) VALUES (?, ?, ?, ?, ?, ?)',
+        (entry, sl, tp, leverage, _now(), symbol)
+    )
+    return cur.lastrowid
+
+
+SIGNAL_COLUMNS = 'id, entry, sl, tp, leverage, created_at, symbol, status, version'
+
+
+@threaded
+def get_signal(signal_id):
+    return get_connection().execute(
+        f'SELECT {SIGNAL_COLUMNS} FROM signals WHERE id = ?', (signal_id,)
+    ).fetchone()
+
+
+@threaded
+def get_signal_version(signal_id):
+    row = get_connection().execute('SELECT version FROM signals WHERE id = ?', (signal_id,)).fetchone()
+    return row[0] if row else None
+
+
+@threaded
+def get_open_signals():
+    """سیگنال‌های نمادداری که هنوز بسته نشده‌اند"""
+    return get_connection().execute(
+        f"SELECT {SIGNAL_COLUMNS} FROM signals WHERE status IN ('open', 'active') AND symbol IS NOT NULL"
+    ).fetchall()
+
+
+@threaded
+def update_signal_status(signal_id, status):
+    get_connection().execute(
+        'UPDATE signals SET status = ?, version = version + 1 WHERE id = ?', (status, signal_id)
+    )
+
+
+@threaded
+def update_signal_levels(signal_id, sl, tp):
+    get_connection().execute(
+        'UPDATE signals SET sl = ?, tp = ?, version = version + 1 WHERE id = ?', (sl, tp, signal_id)
+    )
+
+
+@threaded
+def save_signal_messages(signal_id, messages):
+    """ثبت دسته‌ای پیام‌های ارسال شده؛ messages لیست (user_id, message_id, هش متن) است"""
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO signal_messages (signal_id, user_id, message_id, content_hash) '
+            'VALUES (?, ?, ?, ?)',
+            [(signal_id, *message) for message in messages]
+        )
+
+
+@threaded
+def update_signal_message_hashes(signal_id, hashes):
+    """ثبت هش متن جدید پیام‌های ویرایش شده؛ hashes لیست (user_id, هش) است"""
+    with transaction() as conn:
+        conn.executemany(
+            'UPDATE signal_messages SET content_hash = ? WHERE signal_id = ? AND user_id = ?',
+            [(content_hash, signal_id, user_id) for user_id, content_hash in hashes]
+        )
+
+
+@threaded
+def get_signal_messages(signal_id, after_user_id=0, limit=200):
+    """دسته بعدی (user_id, message_id, هش) پیام‌های یک سیگنال به ترتیب آیدی کاربر"""
+    return get_connection().execute(
+        'SELECT user_id, message_id, content_hash FROM signal_messages '
+        'WHERE signal_id = ? AND user_id > ? ORDER BY user_id LIMIT ?',
+        (signal_id, after_user_id, limit)
+    ).fetchall()
+
+
+@threaded
+def count_signal_messages(signal_id):
+    return get_connection().execute(
+        'SELECT COUNT(*) FROM signal_messages WHERE signal_id = ?', (signal_id,)
+    ).fetchone()[0]
+
+
+# --- پروفایل ریسک ---
+@threaded
+def save_risk_profile(user_id, capital, risk_percent):
+    get_connection().execute(
+        '''
+        INSERT INTO risk_profiles (user_id, capital, risk_percent, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            capital = excluded.capital, risk_percent = excluded.risk_percent, updated_at = excluded.updated_at
+        ''',
+        (user_id, capital, risk_percent, _now())
+    )
+
+
+@threaded
+def get_risk_profile(user_id):
+    return get_connection().execute(
+        'SELECT capital, risk_percent FROM risk_profiles WHERE user_id = ?', (user_id,)
+    ).fetchone()
+
+
+@threaded
+def get_risk_profiles(user_ids):
+    """پروفایل گروهی از کاربران: لیست (user_id, capital, risk_percent)"""
+    return _select_in(
+        get_connection(), 'SELECT user_id, capital, risk_percent FROM risk_profiles WHERE user_id IN ({})', user_ids
+    )
+
+
+# --- وضعیت گفتگو ---
+@threaded
+def get_conversation_states():
+    return get_connection().execute('SELECT user_id, data FROM conversation_state').fetchall()
+
+
+@threaded
+def save_conversation_states(states):
+    """ذخیره دسته‌ای وضعیت‌ها در یک تراکنش؛ داده None یعنی حذف"""
+    now = _now()
+    with transaction() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO conversation_state (user_id, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''',
+            [(user_id, data, now) for user_id, data in states if data is not None]
+        )
+        conn.executemany(
+            'DELETE FROM conversation_state WHERE user_id = ?',
+            [(user_id,) for user_id, data in states if data is None]
+        )
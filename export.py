@@ -0,0 +1,99 @@
+"""خروجی جریانی لیست کاربران تایید شده (اکسل و CSV)"""
+import csv
+import gzip
+import io
+from datetime import datetime
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+
+import db
+
+HEADERS = ["ردیف", "آیدی کاربر", "تلفن", "نام کامل", "کد ملی", "تاریخ ثبت‌نام"]
+COLUMN_WIDTHS = [8, 15, 15, 25, 15, 20]
+FETCH_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'xlsx': 'xlsx',
+    'excel': 'xlsx',
+    'csv': 'csv',
+    'gz': 'csv.gz',
+    'csv.gz': 'csv.gz',
+}
+
+
+def _user_rows():
+    for idx, user in enumerate(db.iter_verified_users(FETCH_CHUNK_SIZE), start=1):
+        yield [idx, user[1], user[2], user[3], user[4], user[5]]
+
+
+def create_excel_file(fileobj):
+    """نوشتن اکسل در حالت write_only؛ تعداد ردیف‌ها را برمی‌گرداند"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("کاربران تایید شده")
+
+    for i, width in enumerate(COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    header_alignment = Alignment(horizontal='center', vertical='center')
+
+    header_row = []
+    for title in HEADERS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        header_row.append(cell)
+    ws.append(header_row)
+
+    count = 0
+    for row in _user_rows():
+        ws.append(row)
+        count += 1
+
+    wb.save(fileobj)
+    return count
+
+
+def create_csv_file(fileobj, compress=False):
+    """نوشتن CSV (با BOM برای نمایش درست فارسی در اکسل)؛ تعداد ردیف‌ها را برمی‌گرداند"""
+    raw = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    writer.writerow(HEADERS)
+
+    count = 0
+    for row in _user_rows():
+        writer.writerow(row)
+        count += 1
+
+    text.flush()
+    text.detach()
+    if compress:
+        raw.close()
+    return count
+
+
+def build_export(fmt='xlsx'):
+    """
+    ساخت فایل خروجی در حافظه
+
+    خروجی: (محتوا به صورت bytes، نام فایل) یا None اگر کاربری وجود نداشته باشد.
+    کتابخانه تلگرام پیش از آپلود کل فایل را در حافظه می‌خواند، پس فایل موقت روی
+    دیسک صرفه‌جویی حافظه‌ای ندارد.
+    """
+    with io.BytesIO() as buffer:
+        if fmt == 'xlsx':
+            count = create_excel_file(buffer)
+        else:
+            count = create_csv_file(buffer, compress=(fmt == 'csv.gz'))
+        if not count:
+            return None
+        data = buffer.getvalue()
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return data, f"users_{timestamp}.{fmt}"
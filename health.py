@@ -0,0 +1,112 @@
+"""بررسی سلامت واقعی ربات برای /health و /ready"""
+import asyncio
+import logging
+import time
+
+from telegram.error import TelegramError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+LAG_INTERVAL = 0.5
+# بالاتر از این مقادیر ربات ناسالم گزارش می‌شود (ثانیه)
+LAG_LIMIT = 5.0
+DB_TIMEOUT = 3.0
+GET_ME_TIMEOUT = 10.0
+GET_ME_CACHE_TTL = 60
+
+
+class HealthMonitor:
+    def __init__(self):
+        self.application = None
+        self.started = time.monotonic()
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self.last_update = None
+        self.webhook = False
+        # در اجرای چندپروسه‌ای: تابعی که وضعیت کارگرها را برمی‌گرداند
+        self.workers = None
+        self._get_me = None
+        self._get_me_checked = 0.0
+        self._lag_task = None
+
+    def start(self, application):
+        self.application = application
+        self._lag_task = asyncio.create_task(self._measure_lag())
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def _measure_lag(self):
+        """تأخیر حلقه رویداد: فاصله بیدار شدن واقعی از زمان مورد انتظار"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.loop_lag = max(0.0, loop.time() - expected)
+            self.max_loop_lag = max(self.max_loop_lag * 0.9, self.loop_lag)
+
+    def mark_update(self):
+        self.last_update = time.monotonic()
+
+    async def _check_db(self):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(db.ping(), DB_TIMEOUT)
+            return {'ok': True, 'latency_ms': round((time.monotonic() - started) * 1000, 1)}
+        except Exception as e:
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    async def _check_telegram(self):
+        """نتیجه getMe با کش کوتاه‌مدت تا هر درخواست سلامت به تلگرام نرسد"""
+        if self._get_me and time.monotonic() - self._get_me_checked < GET_ME_CACHE_TTL:
+            return self._get_me
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.application.bot.get_me(), GET_ME_TIMEOUT)
+            result = {'ok': True, 'latency_ms': round((time.monotonic() - started) * 1000, 1)}
+        except (TelegramError, asyncio.TimeoutError) as e:
+            result = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        self._get_me = result
+        self._get_me_checked = time.monotonic()
+        return result
+
+    async def check(self):
+        """خروجی: (سالم است، آماده است، گزارش)"""
+        if self.application is None:
+            return False, False, {'status': 'starting'}
+
+        database, telegram = await asyncio.gather(self._check_db(), self._check_telegram())
+        backlog_jobs, backlog_messages = (await db.get_broadcast_backlog()) if database['ok'] else (None, None)
+        updater = self.application.updater
+        receiving = self.webhook or (updater is not None and updater.running)
+
+        report = {
+            'uptime': round(time.monotonic() - self.started),
+            'loop_lag_ms': round(self.loop_lag * 1000, 1),
+            'max_loop_lag_ms': round(self.max_loop_lag * 1000, 1),
+            'database': database,
+            'telegram': telegram,
+            'broadcast_backlog': {'jobs': backlog_jobs, 'messages': backlog_messages},
+            'seconds_since_last_update': (
+                round(time.monotonic() - self.last_update) if self.last_update else None
+            ),
+            'running': self.application.running,
+        }
+        healthy = self.loop_lag < LAG_LIMIT and database['ok'] and self.application.running
+        if self.workers is not None:
+            report['workers'] = self.workers()
+            healthy = healthy and all(worker['alive'] for worker in report['workers'])
+        ready = healthy and telegram['ok'] and receiving
+        report['status'] = 'ok' if ready else ('degraded' if healthy else 'unhealthy')
+        return healthy, ready, report
+
+
+monitor = HealthMonitor()
@@ -0,0 +1,200 @@
+"""ثبت معیارهای عملکرد (شمارنده، گیج و هیستوگرام) با خروجی متنی Prometheus"""
+import copy
+import functools
+import time
+from bisect import bisect_left
+
+from telegram.request import HTTPXRequest
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield self.name, labels, None, value
+
+    @staticmethod
+    def _add(value, other):
+        return value + other
+
+    def merged(self, snapshots):
+        """مقادیر این معیار به جمع مقادیر همین معیار در snapshot پروسه‌های دیگر"""
+        values = self._values
+        for snapshot in snapshots:
+            other = snapshot.get(self.name)
+            if not other:
+                continue
+            if values is self._values:
+                values = copy.deepcopy(values)
+            for labels, value in other.items():
+                values[labels] = self._add(values[labels], value) if labels in values else value
+        return values
+
+    def render(self, snapshots=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self._samples(self.merged(snapshots)):
+            lines.append(f"{name}{_format_labels(self.labelnames, labels, extra)} {value}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # شمارش هر باکت به صورت جداگانه؛ در خروجی تجمعی می‌شود
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @staticmethod
+    def _add(value, other):
+        counts, total, count = value
+        return [[a + b for a, b in zip(counts, other[0])], total + other[1], count + other[2]]
+
+    def _samples(self, values):
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels, ('le', repr(bound)), cumulative
+            yield f"{self.name}_bucket", labels, ('le', '+Inf'), count
+            yield f"{self.name}_sum", labels, None, total
+            yield f"{self.name}_count", labels, None, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """کپی مقادیر همه معیارها برای ارسال به پروسه دیگر"""
+        return {name: copy.deepcopy(metric._values) for name, metric in self._metrics.items()}
+
+    def render(self, snapshots=()):
+        """خروجی متنی؛ snapshots مقادیر پروسه‌های کارگر است که با مقادیر این پروسه جمع می‌شود"""
+        return '\n'.join(metric.render(snapshots) for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+# --- معیارهای مشترک ---
+handler_calls = registry.counter('bot_handler_calls_total', 'Handler invocations', ('handler', 'status'))
+handler_seconds = registry.histogram('bot_handler_duration_seconds', 'Handler latency', ('handler',))
+handler_in_flight = registry.gauge('bot_handler_in_flight', 'Handlers currently running', ('handler',))
+
+db_calls = registry.counter('bot_db_calls_total', 'Database helper calls', ('function', 'status'))
+db_seconds = registry.histogram('bot_db_duration_seconds', 'Database helper latency', ('function',))
+db_in_flight = registry.gauge('bot_db_in_flight', 'Database helpers currently running', ('function',))
+
+api_calls = registry.counter('bot_telegram_api_calls_total', 'Telegram Bot API requests', ('method', 'code'))
+api_seconds = registry.histogram('bot_telegram_api_duration_seconds', 'Telegram Bot API latency', ('method',))
+api_in_flight = registry.gauge('bot_telegram_api_in_flight', 'Telegram Bot API requests in flight', ('method',))
+
+send_errors = registry.counter('bot_send_errors_total', 'Failed fan-out deliveries by error type', ('error',))
+
+
+def instrument(name, calls, seconds, in_flight):
+    """دکوراتور اندازه‌گیری یک تابع async با شمارنده، هیستوگرام و گیج در حال اجرا"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            in_flight.inc(name)
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                status = 'error'
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - started, name)
+                calls.inc(name, status)
+                in_flight.dec(name)
+        return wrapper
+    return decorator
+
+
+def instrument_handlers(application):
+    """پوشاندن callback همه هندلرهای ثبت شده در Application"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            name = getattr(handler.callback, '__name__', type(handler).__name__)
+            handler.callback = instrument(name, handler_calls, handler_seconds, handler_in_flight)(
+                handler.callback
+            )
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """لایه درخواست تلگرام که زمان و کد پاسخ هر متد Bot API را ثبت می‌کند"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        api_in_flight.inc(api_method)
+        started = time.perf_counter()
+        code = 'network_error'
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            return code, payload
+        finally:
+            api_seconds.observe(time.perf_counter() - started, api_method)
+            api_calls.inc(api_method, str(code))
+            api_in_flight.dec(api_method)
@@ -0,0 +1,248 @@
+"""پایش قیمت و تشخیص فعال شدن ورود/حد سود/حد ضرر سیگنال‌های باز"""
+import asyncio
+import json
+import logging
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PriceTick = namedtuple('PriceTick', ('symbol', 'price'))
+
+# نوع رویدادها
+ENTRY = 'entry'
+TP = 'tp'
+SL = 'sl'
+
+# قالب نماد جفت ارز (مثل BTCUSDT)
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9]{2,20}$')
+
+
+def normalize_symbol(symbol):
+    """نماد با حروف بزرگ؛ نماد نامعتبر ValueError می‌دهد"""
+    symbol = symbol.strip().upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"Invalid symbol: {symbol!r}")
+    return symbol
+
+
+# --- منابع قیمت ---
+class PriceFeed(ABC):
+    """منبع قیمت؛ زیرکلاس‌ها ticks را به صورت async iterator پیاده‌سازی می‌کنند"""
+
+    @abstractmethod
+    def ticks(self):
+        """تیک‌های قیمت (PriceTick) به صورت async iterator"""
+
+
+class QueueFeed(PriceFeed):
+    """منبع قیمت دستی (برای تست و شبیه‌سازی)؛ با close پایان می‌یابد"""
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+
+    def push(self, symbol, price):
+        self._queue.put_nowait(PriceTick(symbol.upper(), float(price)))
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+    async def ticks(self):
+        while True:
+            tick = await self._queue.get()
+            if tick is None:
+                return
+            yield tick
+
+
+class ReplayFeed(PriceFeed):
+    """
+    پخش مجدد قیمت‌ها از فایل
+
+    هر خط یا `SYMBOL,PRICE` است یا JSON با کلیدهای symbol و price.
+    با delay بین تیک‌ها فاصله زمانی ایجاد می‌شود.
+    """
+
+    def __init__(self, path, delay=0.0):
+        self.path = path
+        self.delay = delay
+
+    async def ticks(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('{'):
+                    data = json.loads(line)
+                    symbol, price = data['symbol'], data['price']
+                else:
+                    symbol, price = line.split(',')[:2]
+                yield PriceTick(symbol.strip().upper(), float(price))
+                await asyncio.sleep(self.delay)
+
+
+class BinancePollingFeed(PriceFeed):
+    """
+    دریافت دوره‌ای قیمت نمادهای تحت پایش از API عمومی بایننس
+
+    بایننس کل درخواست چندنمادی را با یک نماد نامعتبر رد می‌کند (400)؛ در این حالت
+    نمادها تک‌تک بررسی می‌شوند و نمادهای رد شده کنار گذاشته می‌شوند تا پایش بقیه
+    سیگنال‌ها متوقف نشود.
+    """
+
+    URL = "https://api.binance.com/api/v3/ticker/price"
+
+    def __init__(self, symbols, interval=2.0, timeout=10):
+        self.symbols = symbols
+        self.interval = interval
+        self.timeout = timeout
+        self.rejected = set()
+
+    async def _fetch(self, client, symbols):
+        response = await client.get(self.URL, params={'symbols': json.dumps(symbols, separators=(',', ':'))})
+        if response.status_code == 400:
+            return None
+        response.raise_for_status()
+        return [PriceTick(item['symbol'], float(item['price'])) for item in response.json()]
+
+    async def _drop_rejected(self, client, symbols):
+        for symbol in symbols:
+            response = await client.get(self.URL, params={'symbol': symbol})
+            if response.status_code == 400:
+                self.rejected.add(symbol)
+                logger.warning(f"⚠️ نماد {symbol} توسط بایننس پذیرفته نشد و از پایش کنار گذاشته شد")
+            else:
+                response.raise_for_status()
+
+    async def ticks(self):
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            while True:
+                symbols = sorted(self.symbols() - self.rejected)
+                if symbols:
+                    try:
+                        ticks = await self._fetch(client, symbols)
+                        if ticks is None:
+                            await self._drop_rejected(client, symbols)
+                        else:
+                            for tick in ticks:
+                                yield tick
+                    except (httpx.HTTPError, ValueError, KeyError) as e:
+                        logger.error(f"Error fetching prices: {e}")
+                await asyncio.sleep(self.interval)
+
+
+def create_feed(spec, symbols):
+    """ساخت منبع قیمت از تنظیمات PRICE_FEED (مثال: binance یا replay:prices.csv)"""
+    kind, _, arg = spec.partition(':')
+    if kind == 'binance':
+        return BinancePollingFeed(symbols, float(arg) if arg else 2.0)
+    if kind == 'replay':
+        return ReplayFeed(arg)
+    raise ValueError(f"Unknown price feed: {spec}")
+
+
+# --- ایندکس سطوح ---
+class TriggerIndex:
+    """سطوح مرتب یک نماد؛ پیدا کردن سطوح عبور شده بین دو قیمت با جستجوی دودویی"""
+
+    def __init__(self):
+        self.levels = []
+        self.items = []
+
+    def add(self, level, signal_id, kind):
+        index = bisect_right(self.levels, level)
+        self.levels.insert(index, level)
+        self.items.insert(index, (signal_id, kind))
+
+    def remove(self, signal_id):
+        keep = [i for i, (sid, _) in enumerate(self.items) if sid != signal_id]
+        if len(keep) != len(self.items):
+            self.levels = [self.levels[i] for i in keep]
+            self.items = [self.items[i] for i in keep]
+
+    def crossed(self, previous, price):
+        """سطوح عبور شده به ترتیب رسیدن قیمت به آن‌ها"""
+        if price > previous:
+            start, end = bisect_right(self.levels, previous), bisect_right(self.levels, price)
+            return [(self.levels[i], *self.items[i]) for i in range(start, end)]
+        if price < previous:
+            start, end = bisect_left(self.levels, price), bisect_left(self.levels, previous)
+            return [(self.levels[i], *self.items[i]) for i in reversed(range(start, end))]
+        return []
+
+    def __len__(self):
+        return len(self.levels)
+
+
+class SignalMonitor:
+    """
+    پایش همه سیگنال‌های باز
+
+    سیگنال با وضعیت open منتظر ورود است و بعد از ورود (active) حد سود و ضرر آن
+    فعال می‌شود. on_hit برای هر رویداد با (signal_id، نوع رویداد، قیمت) صدا زده می‌شود.
+    """
+
+    def __init__(self, on_hit):
+        self.on_hit = on_hit
+        self.indexes = {}
+        self.last_price = {}
+        self.signals = {}
+
+    def symbols(self):
+        return {symbol for symbol, index in self.indexes.items() if len(index)}
+
+    def watch(self, signal):
+        if not signal.symbol or signal.status not in ('open', 'active'):
+            return
+        self.unwatch(signal.id)
+        symbol = signal.symbol.upper()
+        index = self.indexes.setdefault(symbol, TriggerIndex())
+        self.signals[signal.id] = (symbol, float(signal.entry), float(signal.sl), float(signal.tp))
+        if signal.status == 'open':
+            index.add(float(signal.entry), signal.id, ENTRY)
+        else:
+            index.add(float(signal.tp), signal.id, TP)
+            index.add(float(signal.sl), signal.id, SL)
+
+    def unwatch(self, signal_id):
+        watched = self.signals.pop(signal_id, None)
+        if watched:
+            self.indexes[watched[0]].remove(signal_id)
+
+    def process(self, symbol, price):
+        """اعمال یک تیک قیمت و بازگرداندن رویدادهای رخ داده"""
+        previous = self.last_price.get(symbol)
+        self.last_price[symbol] = price
+        index = self.indexes.get(symbol)
+        if previous is None or not index:
+            return []
+
+        events = []
+        handled = set()
+        for level, signal_id, kind in index.crossed(previous, price):
+            if signal_id in handled:
+                continue
+            handled.add(signal_id)
+            _, entry, sl, tp = self.signals[signal_id]
+            index.remove(signal_id)
+            if kind == ENTRY:
+                index.add(tp, signal_id, TP)
+                index.add(sl, signal_id, SL)
+            else:
+                del self.signals[signal_id]
+            events.append((signal_id, kind, price))
+        return events
+
+    async def run(self, feed):
+        logger.info("📡 پایش قیمت سیگنال‌ها فعال شد")
+        async for tick in feed.ticks():
+            for signal_id, kind, price in self.process(tick.symbol, tick.price):
+                try:
+                    await self.on_hit(signal_id, kind, price)
+                except Exception as e:
+                    logger.error(f"Error handling signal #{signal_id} {kind}: {e}")
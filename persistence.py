@@ -0,0 +1,118 @@
+"""ذخیره‌سازی وضعیت گفتگوی کاربران در SQLite با نوشتن دسته‌ای (write-behind)"""
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+import state
+
+logger = logging.getLogger(__name__)
+
+# فاصله تحویل داده‌های تغییر کرده از Application به این لایه (ثانیه)
+FLUSH_INTERVAL = 10
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    فقط user_data ذخیره می‌شود
+
+    PTB در هر دوره update_user_data را برای کاربرانی که داده‌شان استفاده شده صدا می‌زند؛
+    اینجا داده فقط سریال و علامت‌گذاری می‌شود و همه تغییرات دوره در یک تراکنش نوشته
+    می‌شوند. کاربرانی که داده‌شان تغییری نکرده اصلاً نوشته نمی‌شوند.
+    """
+
+    def __init__(self, update_interval=FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._persisted = {}
+        self._dirty = {}
+        self._flush_scheduled = False
+        self._flush_lock = asyncio.Lock()
+
+    async def get_user_data(self):
+        rows = await db.get_conversation_states()
+        user_data = {}
+        for user_id, data in rows:
+            self._persisted[user_id] = data
+            try:
+                user_data[user_id] = json.loads(data, object_hook=state.decode)
+            except ValueError:
+                logger.error(f"Invalid stored state for {user_id}")
+        logger.info(f"💾 وضعیت گفتگوی {len(user_data)} کاربر بازیابی شد")
+        return user_data
+
+    def _mark(self, user_id, data):
+        if self._persisted.get(user_id) == data:
+            self._dirty.pop(user_id, None)
+            return
+        self._dirty[user_id] = data
+        if not self._flush_scheduled:
+            # پس از اتمام همه update_user_data های همین دوره اجرا می‌شود
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(lambda: asyncio.create_task(self.flush()))
+
+    async def update_user_data(self, user_id, data):
+        self._mark(user_id, json.dumps(data, default=state.encode, ensure_ascii=False) if data else None)
+
+    async def drop_user_data(self, user_id):
+        self._mark(user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def flush(self):
+        async with self._flush_lock:
+            self._flush_scheduled = False
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            try:
+                await db.save_conversation_states(list(dirty.items()))
+            except Exception as e:
+                logger.error(f"Error flushing conversation states: {e}")
+                # در دوره بعد دوباره تلاش می‌شود
+                self._dirty = {**dirty, **self._dirty}
+                return
+            for user_id, data in dirty.items():
+                if data is None:
+                    self._persisted.pop(user_id, None)
+                else:
+                    self._persisted[user_id] = data
+
+    # --- داده‌هایی که ذخیره نمی‌شوند ---
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,78 @@
+"""پردازش همزمان آپدیت‌ها با حفظ ترتیب برای هر کاربر"""
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# سقف آپدیت‌های در جریان (در صف یا در حال اجرا)؛ بعد از آن دریافت آپدیت متوقف می‌شود
+MAX_PENDING_UPDATES = 4096
+# تعداد هندلرهایی که همزمان اجرا می‌شوند
+MAX_WORKERS = 32
+# مسیر جدا برای عملیات طولانی ادمین (خروجی، ارسال همگانی و ...)
+ADMIN_WORKERS = 2
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    آپدیت‌های کاربران مختلف همزمان اجرا می‌شوند اما آپدیت‌های هر کاربر (یا چت)
+    دقیقاً به ترتیب دریافت.
+
+    برای هر کلید فقط آخرین آپدیت ثبت شده نگه داشته می‌شود و هر آپدیت منتظر پایان
+    آپدیت قبلی همان کلید می‌ماند. آپدیت‌های ادمین در مسیر جداگانه با ظرفیت خودش اجرا
+    می‌شوند تا عملیات طولانی ادمین کاربران را معطل نکند.
+    """
+
+    def __init__(self, admin_ids=(), max_workers=MAX_WORKERS, admin_workers=ADMIN_WORKERS,
+                 max_pending=MAX_PENDING_UPDATES):
+        super().__init__(max_pending)
+        self.admin_ids = frozenset(admin_ids)
+        self._workers = asyncio.Semaphore(max_workers)
+        self._admin_workers = asyncio.Semaphore(admin_workers)
+        self._tails = {}
+
+    @staticmethod
+    def key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.key(update)
+        lane = self._admin_workers if key in self.admin_ids else self._workers
+        if key is None:
+            async with lane:
+                await coroutine
+            return
+
+        # این بخش تا اولین await همگام اجرا می‌شود، پس ترتیب ثبت همان ترتیب دریافت است
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        started = False
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with lane:
+                started = True
+                await coroutine
+        finally:
+            if not started:
+                coroutine.close()
+            if not done.done():
+                done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._tails:
+            logger.info(f"⏳ انتظار برای پایان آپدیت‌های {len(self._tails)} کاربر")
+            await asyncio.gather(*self._tails.values())
@@ -0,0 +1,47 @@
+"""پروفایل ریسک کاربران و محاسبه دسته‌ای اعداد شخصی هر سیگنال"""
+import numpy as np
+
+import db
+
+# قالب از پیش آماده؛ برای هر گیرنده فقط یک فراخوانی format
+PERSONAL_TEMPLATE = (
+    "\n\n👤 <b>محاسبه بر اساس پروفایل شما</b> (سرمایه {0:.2f} دلار، ریسک {1:g}٪):\n"
+    "💳 حجم پوزیشن با اهرم: <b>{2:.2f} دلار</b> (مارجین {3:.2f} دلار)\n"
+    "📉 ضرر در صورت استاپ: <b>{4:.2f} دلار</b>\n"
+    "📈 سود در صورت رسیدن به حد سود: <b>{5:.2f} دلار</b>"
+).format
+
+
+def render_personal(table, profiles):
+    """
+    محاسبه اعداد همه گیرندگان در یک عملیات برداری
+
+    profiles لیست (user_id, capital, risk_percent) است. درصد ریسک، درصد سرمایه درگیر
+    در معامله است (مثل دکمه‌های درصد سیگنال). خروجی: دیکشنری user_id -> متن شخصی.
+    """
+    if not profiles:
+        return {}
+    user_ids, capitals, percents = zip(*profiles)
+    capitals = np.asarray(capitals, dtype=np.float64)
+    percents = np.asarray(percents, dtype=np.float64)
+    margin = capitals * percents / 100
+    exposure = margin * float(table.leverage)
+    loss = exposure * float(table.loss_ratio)
+    profit = exposure * float(table.profit_ratio)
+    rows = zip(capitals.tolist(), percents.tolist(), exposure.tolist(), margin.tolist(),
+               loss.tolist(), profit.tolist())
+    return {user_id: PERSONAL_TEMPLATE(*row) for user_id, row in zip(user_ids, rows)}
+
+
+class PersonalizedSignal:
+    """متن شخصی هر گیرنده؛ prepare قبل از ارسال هر دسته گیرندگان صدا زده می‌شود"""
+
+    def __init__(self, signal):
+        self.table = signal.table
+        self._texts = {}
+
+    async def prepare(self, user_ids):
+        self._texts = render_personal(self.table, await db.get_risk_profiles(user_ids))
+
+    def text(self, user_id):
+        return self._texts.get(user_id, '')
@@ -0,0 +1,55 @@
+"""تجمیع فیش‌های پرداخت ارسالی یک کاربر (آلبوم یا چند عکس پشت سر هم)"""
+
+# مدت انتظار برای رسیدن بقیه عکس‌های آلبوم (ثانیه)
+RECEIPT_WINDOW = 2.0
+
+# حداکثر عکس در هر send_media_group
+MEDIA_GROUP_LIMIT = 10
+
+
+class ReceiptBatch:
+    """فیش‌های یک ثبت‌نام؛ عکس تکراری (file_unique_id یکسان) نادیده گرفته می‌شود"""
+    __slots__ = ('user_id', 'phone', 'full_name', 'nid', 'file_ids', 'unique_ids')
+
+    def __init__(self, user_id, registration):
+        self.user_id = user_id
+        self.phone = registration.phone
+        self.full_name = registration.full_name
+        self.nid = registration.nid
+        self.file_ids = []
+        self.unique_ids = set()
+
+    def add(self, photo):
+        if photo.file_unique_id in self.unique_ids:
+            return False
+        self.unique_ids.add(photo.file_unique_id)
+        self.file_ids.append(photo.file_id)
+        return True
+
+    def to_pending(self):
+        return {
+            'user_id': self.user_id,
+            'phone': self.phone,
+            'full_name': self.full_name,
+            'nid': self.nid,
+            'file_ids': self.file_ids
+        }
+
+
+class ReceiptCollector:
+    """دسته‌های باز به ازای هر کاربر (فرستنده عکس‌ها) تا پایان بازه انتظار"""
+
+    def __init__(self):
+        self.batches = {}
+
+    def add(self, user_id, registration, photo):
+        batch = self.batches.get(user_id)
+        if batch is None:
+            batch = self.batches[user_id] = ReceiptBatch(user_id, registration)
+        return batch.add(photo)
+
+    def pop(self, user_id):
+        return self.batches.pop(user_id, None)
+
+
+collector = ReceiptCollector()
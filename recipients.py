@@ -0,0 +1,67 @@
+"""کش سراسری آیدی کاربران تایید شده برای ارسال همگانی"""
+import threading
+from array import array
+from bisect import bisect_right
+
+
+class RecipientCache:
+    """
+    مجموعه آیدی کاربران تایید شده
+
+    بررسی عضویت O(1) است و برای ارسال یک آرایه مرتب و فشرده (array('q'))
+    ساخته می‌شود که تا تغییر بعدی کش باقی می‌ماند.
+    """
+
+    def __init__(self):
+        self._ids = set()
+        self._sorted = None
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, user_ids):
+        with self._lock:
+            self._ids = set(user_ids)
+            self._sorted = None
+            self.loaded = True
+
+    def add(self, user_id):
+        with self._lock:
+            if user_id not in self._ids:
+                self._ids.add(user_id)
+                self._sorted = None
+
+    def discard(self, user_id):
+        with self._lock:
+            if user_id in self._ids:
+                self._ids.discard(user_id)
+                self._sorted = None
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def snapshot(self):
+        """آرایه مرتب آیدی‌ها"""
+        snapshot = self._sorted
+        if snapshot is None:
+            with self._lock:
+                if self._sorted is None:
+                    self._sorted = array('q', sorted(self._ids))
+                snapshot = self._sorted
+        return snapshot
+
+    def after(self, last_user_id, limit):
+        """دسته بعدی آیدی‌ها بعد از last_user_id (به ترتیب صعودی)"""
+        snapshot = self.snapshot()
+        start = bisect_right(snapshot, last_user_id)
+        return snapshot[start:start + limit].tolist()
+
+    def fingerprint(self):
+        """(تعداد، مجموع آیدی‌ها) برای مقایسه ارزان با دیتابیس"""
+        with self._lock:
+            return len(self._ids), sum(self._ids)
+
+
+cache = RecipientCache()
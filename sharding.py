@@ -0,0 +1,180 @@
+"""
+اجرای چندپروسه‌ای: یک پروسه دریافت آپدیت و N پروسه پردازش
+
+پروسه ورودی (polling یا وب‌هوک) هر آپدیت را بر اساس آیدی کاربر به صف یکی از
+پروسه‌های کارگر می‌فرستد؛ پس آپدیت‌های هر کاربر همیشه در یک پروسه و به ترتیب
+پردازش می‌شوند. وضعیت مشترک در دیتابیس SQLite (WAL) است.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+import metrics
+from processor import OrderedUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# تعداد پروسه‌های کارگر (۱ = اجرای عادی تک‌پروسه‌ای)
+WORKERS = int(os.environ.get('WORKERS', 1))
+# پروسه‌های محاسبات سنگین (خروجی اکسل و ...)؛ ۰ یعنی اجرا در ترد
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', 1 if WORKERS > 1 else 0))
+# فاصله بررسی زنده بودن کارگرها (ثانیه)
+WORKER_CHECK_INTERVAL = 10
+# فاصله ارسال معیارهای هر کارگر به پروسه ورودی برای /metrics (ثانیه)
+METRICS_INTERVAL = 5
+QUEUE_POLL_TIMEOUT = 1.0
+
+# spawn تا اتصال‌های دیتابیس و حلقه رویداد پروسه والد به فرزند منتقل نشود
+_mp = multiprocessing.get_context('spawn')
+_cpu_pool = None
+
+
+async def run_cpu(func, *args):
+    """اجرای تابع سنگین در استخر پروسه (یا ترد اگر CPU_WORKERS صفر باشد)"""
+    global _cpu_pool
+    if CPU_WORKERS <= 0:
+        return await asyncio.to_thread(func, *args)
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=_mp)
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, func, *args)
+
+
+def shutdown_cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(cancel_futures=True)
+        _cpu_pool = None
+
+
+class ShardRouter:
+    """
+    صف و پروسه هر کارگر
+
+    target تابعی در سطح ماژول با امضای (index, workers, queue, stats) است. آپدیت‌های ادمین
+    همیشه به کارگر ۰ می‌روند تا کارهای ادمین و کارهای زمان‌بندی شده در یک پروسه باشند.
+    کارگرها معیارهای خود را در صف مشترک stats می‌گذارند (report_metrics) تا /metrics و
+    /health پروسه ورودی وضعیت همه پروسه‌ها را نشان دهند.
+    """
+
+    def __init__(self, target, workers=WORKERS, admin_ids=()):
+        self.target = target
+        self.workers = workers
+        self.admin_ids = frozenset(admin_ids)
+        self.queues = [_mp.Queue() for _ in range(workers)]
+        self.stats = _mp.Queue()
+        self.processes = [None] * workers
+        # index -> (pid، زمان دریافت، snapshot معیارها)
+        self.reports = {}
+
+    def shard(self, update):
+        key = OrderedUpdateProcessor.key(update)
+        if key is None or key in self.admin_ids:
+            return 0
+        return key % self.workers
+
+    def _spawn(self, index):
+        process = _mp.Process(
+            target=self.target, args=(index, self.workers, self.queues[index], self.stats),
+            name=f"bot-worker-{index}", daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"🧩 کارگر {index} با pid {process.pid} اجرا شد")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def check(self):
+        """راه‌اندازی مجدد کارگرهایی که از کار افتاده‌اند؛ صف آن‌ها حفظ می‌شود"""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"❌ کارگر {index} با کد {process.exitcode} متوقف شد؛ راه‌اندازی مجدد")
+                self._spawn(index)
+
+    def collect(self):
+        """خواندن معیارهای رسیده از کارگرها؛ خروجی snapshot کارگرهای فعلی"""
+        while True:
+            try:
+                index, pid, snapshot = self.stats.get_nowait()
+            except Empty:
+                break
+            self.reports[index] = (pid, time.monotonic(), snapshot)
+        snapshots = []
+        for index, process in enumerate(self.processes):
+            report = self.reports.get(index)
+            # معیارهای کارگر از کار افتاده همراه با خودش از بین رفته‌اند
+            if report and process is not None and report[0] == process.pid:
+                snapshots.append(report[2])
+        return snapshots
+
+    def status(self):
+        """وضعیت کارگرها برای /health"""
+        self.collect()
+        now = time.monotonic()
+        workers = []
+        for index, process in enumerate(self.processes):
+            report = self.reports.get(index)
+            fresh = report is not None and process is not None and report[0] == process.pid
+            workers.append({
+                'index': index,
+                'pid': process.pid if process is not None else None,
+                'alive': process is not None and process.is_alive(),
+                'seconds_since_report': round(now - report[1]) if fresh else None,
+            })
+        return workers
+
+    async def forward(self, update: Update, context):
+        """هندلر پروسه ورودی: ارسال آپدیت به صف کارگر و توقف پردازش محلی"""
+        self.queues[self.shard(update)].put(update.to_dict())
+        raise ApplicationHandlerStop
+
+    async def stop(self, timeout=30):
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+def report_metrics(stats, index):
+    """ارسال snapshot معیارهای این کارگر به پروسه ورودی"""
+    stats.put((index, os.getpid(), metrics.registry.snapshot()))
+
+
+def _get(queue):
+    try:
+        return queue.get(timeout=QUEUE_POLL_TIMEOUT)
+    except Empty:
+        return Empty
+
+
+async def consume(queue, application):
+    """حلقه کارگر: خواندن آپدیت‌ها از صف و تحویل به Application تا رسیدن None یا توقف پروسه ورودی"""
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    while True:
+        data = await loop.run_in_executor(None, _get, queue)
+        if data is Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning("⚠️ پروسه ورودی متوقف شده است؛ پایان کارگر")
+                return
+            continue
+        if data is None:
+            return
+        try:
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.error(f"Invalid update from ingress: {e}")
+            continue
+        await application.update_queue.put(update)
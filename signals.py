@@ -0,0 +1,107 @@
+"""رکورد سیگنال‌های معاملاتی ذخیره شده با کش LRU در حافظه"""
+import hashlib
+import time
+from collections import OrderedDict
+
+import db
+from sizing import SizingTable
+
+SIGNAL_CACHE_SIZE = 256
+# حداکثر عمر سیگنال کش شده بدون بررسی نسخه آن در دیتابیس (ثانیه)؛ با چند worker
+# تغییر حد ضرر/سود در یک پروسه حداکثر پس از این مدت در بقیه دیده می‌شود
+SIGNAL_CACHE_TTL = 5
+
+
+class Signal:
+    __slots__ = ('id', 'entry', 'sl', 'tp', 'leverage', 'created_at', 'symbol', 'status', 'version',
+                 '_table', '_checked')
+
+    def __init__(self, id, entry, sl, tp, leverage, created_at=None, symbol=None, status='open', version=0):
+        self.id = id
+        self.entry = entry
+        self.sl = sl
+        self.tp = tp
+        self.leverage = leverage
+        self.created_at = created_at
+        self.symbol = symbol
+        self.status = status
+        self.version = version
+        self._table = None
+        self._checked = time.monotonic()
+
+    @property
+    def table(self):
+        """جدول ضرایب حجم پوزیشن؛ یک بار برای هر سیگنال ساخته می‌شود"""
+        if self._table is None:
+            self._table = SizingTable(self.entry, self.sl, self.tp, self.leverage)
+        return self._table
+
+    @property
+    def position_type(self):
+        # جهت از TP تعیین می‌شود چون SL پس از ویرایش می‌تواند به سمت سود منتقل شود
+        return "Long" if float(self.tp) > float(self.entry) else "Short"
+
+    @property
+    def loss_percent(self):
+        return abs((float(self.sl) - float(self.entry)) / float(self.entry)) * 100
+
+
+_cache = OrderedDict()
+
+
+def _remember(signal):
+    _cache[signal.id] = signal
+    _cache.move_to_end(signal.id)
+    if len(_cache) > SIGNAL_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return signal
+
+
+async def create_signal(entry, sl, tp, leverage, symbol=None):
+    signal_id = await db.create_signal(entry, sl, tp, leverage, symbol)
+    return _remember(Signal(signal_id, entry, sl, tp, leverage, symbol=symbol))
+
+
+async def get_signal(signal_id):
+    """سیگنال از کش؛ پس از SIGNAL_CACHE_TTL فقط نسخه آن با دیتابیس مقایسه می‌شود و در صورت
+    تغییر (مثلاً ویرایش در worker دیگر) یا نبودن در کش سیگنال دوباره خوانده می‌شود"""
+    signal = _cache.get(signal_id)
+    if signal is not None and time.monotonic() - signal._checked >= SIGNAL_CACHE_TTL:
+        if await db.get_signal_version(signal_id) == signal.version:
+            signal._checked = time.monotonic()
+        else:
+            invalidate(signal_id)
+            signal = None
+    if signal is not None:
+        _cache.move_to_end(signal_id)
+        return signal
+    row = await db.get_signal(signal_id)
+    return _remember(Signal(*row)) if row else None
+
+
+async def get_open_signals():
+    return [_remember(Signal(*row)) for row in await db.get_open_signals()]
+
+
+async def set_status(signal_id, status):
+    await db.update_signal_status(signal_id, status)
+    signal = _cache.get(signal_id)
+    if signal is not None:
+        signal.status = status
+        signal.version += 1
+
+
+async def update_levels(signal_id, sl, tp):
+    """تغییر حد ضرر و حد سود؛ جدول ضرایب با خواندن دوباره سیگنال از نو ساخته می‌شود"""
+    await db.update_signal_levels(signal_id, sl, tp)
+    invalidate(signal_id)
+    return await get_signal(signal_id)
+
+
+def invalidate(signal_id):
+    _cache.pop(signal_id, None)
+
+
+def content_hash(text):
+    """هش ۶۴ بیتی متن پیام (قابل ذخیره در ستون INTEGER) برای تشخیص پیام‌های بدون تغییر"""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big', signed=True)
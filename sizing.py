@@ -0,0 +1,75 @@
+"""
+محاسبه حجم پوزیشن: سرمایه درگیر، ضرر دلاری، نسبت ریسک به ریوارد و قیمت لیکوئید
+
+پاسخ تک کاربر با Decimal و از ضرایب SizingTable است؛ محاسبه دسته‌ای همه گیرندگان
+یک سیگنال با NumPy در profiles.render_personal انجام می‌شود.
+"""
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+# نرخ مارجین نگهداری برای تخمین قیمت لیکوئید (مارجین ایزوله)
+MAINTENANCE_MARGIN_RATE = Decimal('0.004')
+
+HUNDRED = Decimal(100)
+
+Sizing = namedtuple('Sizing', ('margin', 'exposure', 'loss', 'profit', 'rr', 'liquidation'))
+
+
+def to_decimal(value):
+    """تبدیل ورودی (رشته، عدد) به Decimal؛ مقدار نامعتبر یا غیر مثبت ValueError می‌دهد"""
+    try:
+        number = value if isinstance(value, Decimal) else Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid number: {value!r}")
+    if not number.is_finite() or number <= 0:
+        raise ValueError(f"Invalid number: {value!r}")
+    return number
+
+
+def liquidation_price(entry, tp, leverage):
+    """تخمین قیمت لیکوئید؛ جهت پوزیشن از موقعیت TP نسبت به ورود تعیین می‌شود
+    (SL ممکن است به نقطه سر به سر یا سود منتقل شده باشد)"""
+    entry, leverage = to_decimal(entry), to_decimal(leverage)
+    distance = 1 / leverage - MAINTENANCE_MARGIN_RATE
+    if to_decimal(tp) > entry:
+        return entry * (1 - distance)
+    return entry * (1 + distance)
+
+
+class SizingTable:
+    """
+    ضرایب از پیش محاسبه شده یک سیگنال برای هر درصد سرمایه
+
+    همه خروجی‌ها نسبت به سرمایه خطی هستند؛ پس برای هر درصد فقط ضریب هر دلار سرمایه
+    نگه داشته می‌شود و پاسخ هر کاربر یک ضرب است نه محاسبه دوباره.
+    """
+
+    def __init__(self, entry, sl, tp, leverage, percents=()):
+        self.entry = to_decimal(entry)
+        self.sl = to_decimal(sl)
+        self.tp = to_decimal(tp)
+        self.leverage = to_decimal(leverage)
+        self.loss_ratio = abs(self.entry - self.sl) / self.entry
+        self.profit_ratio = abs(self.tp - self.entry) / self.entry
+        self.rr = self.profit_ratio / self.loss_ratio if self.loss_ratio else Decimal(0)
+        self.liquidation = liquidation_price(self.entry, self.tp, self.leverage)
+        self._factors = {}
+        for percent in percents:
+            self.factors(percent)
+
+    def factors(self, percent):
+        """(مارجین، حجم، ضرر، سود) به ازای هر دلار سرمایه"""
+        percent = to_decimal(percent)
+        factors = self._factors.get(percent)
+        if factors is None:
+            margin = percent / HUNDRED
+            exposure = margin * self.leverage
+            factors = (margin, exposure, exposure * self.loss_ratio, exposure * self.profit_ratio)
+            self._factors[percent] = factors
+        return factors
+
+    def size(self, capital, percent):
+        capital = to_decimal(capital)
+        margin, exposure, loss, profit = self.factors(percent)
+        return Sizing(capital * margin, capital * exposure, capital * loss, capital * profit,
+                      self.rr, self.liquidation)
@@ -0,0 +1,82 @@
+"""وضعیت گفتگوی هر کاربر به صورت رکوردهای فشرده (به جای کلیدهای پراکنده در user_data)"""
+
+STATE_KEY = 'state'
+
+
+class State:
+    __slots__ = ()
+    kind = None
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self):
+        return {'__state__': self.kind, **{name: getattr(self, name) for name in self.__slots__}}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Registration(State):
+    """ثبت‌نام سیگنال؛ step یکی از awaiting_phone، awaiting_name_nid، awaiting_payment"""
+    __slots__ = ('step', 'user_id', 'phone', 'full_name', 'nid')
+    kind = 'registration'
+
+
+class StopLossInput(State):
+    __slots__ = ()
+    kind = 'stop_loss'
+
+
+class CapitalInput(State):
+    __slots__ = ('percent', 'signal_id')
+    kind = 'capital'
+
+
+class RiskProfileInput(State):
+    __slots__ = ()
+    kind = 'risk_profile'
+
+
+class AdminBroadcastInput(State):
+    __slots__ = ()
+    kind = 'admin_broadcast'
+
+
+class SignalInput(State):
+    __slots__ = ()
+    kind = 'signal'
+
+
+STATE_TYPES = {cls.kind: cls for cls in State.__subclasses__()}
+
+
+def encode(obj):
+    """برای json.dumps(default=encode)"""
+    if isinstance(obj, State):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def decode(data):
+    """برای json.loads(object_hook=decode)"""
+    kind = data.pop('__state__', None)
+    if kind is None:
+        return data
+    cls = STATE_TYPES.get(kind)
+    return cls(**data) if cls else None
+
+
+def get_state(context):
+    return context.user_data.get(STATE_KEY)
+
+
+def set_state(context, state):
+    context.user_data[STATE_KEY] = state
+    return state
+
+
+def clear_state(context):
+    context.user_data.pop(STATE_KEY, None)
@@ -0,0 +1,176 @@
+"""سرور HTTP سبک روی حلقه رویداد ربات و سیستم بیدار ماندن"""
+import asyncio
+import json
+import logging
+import random
+import time
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30
+KEEP_ALIVE_TIMEOUT = 75
+
+PING_TIMEOUT = 10
+PING_BACKOFF_BASE = 5
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='text/plain; charset=utf-8', headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, ensure_ascii=False), status, 'application/json; charset=utf-8')
+
+
+class WebServer:
+    """سرور HTTP/1.1 مینیمال بر پایه asyncio.start_server"""
+
+    def __init__(self):
+        self.routes = {}
+        self._server = None
+
+    def route(self, path, methods=('GET',)):
+        def decorator(handler):
+            for method in methods:
+                self.routes[(method, path)] = handler
+            return handler
+        return decorator
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"🌐 سرور وب روی پورت {port} فعال شد")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b''
+        return Request(method.upper(), target, headers, body)
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if request.method == 'HEAD':
+                handler = self.routes.get(('GET', request.path))
+            if handler is None:
+                return Response(status=404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return Response(status=500)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                if request is None:
+                    break
+
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                body = b'' if request.method == 'HEAD' else response.body
+                head = [
+                    f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}",
+                    f"Content-Type: {response.content_type}",
+                    f"Content-Length: {len(response.body)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                ]
+                head.extend(f"{name}: {value}" for name, value in response.headers.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class KeepAlive:
+    """پینگ دوره‌ای آدرس عمومی سرویس با کلاینت ماندگار، تایم‌اوت و بازگشت نمایی"""
+
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.last_latency = None
+        self.last_status = None
+        self.failures = 0
+        self.total = 0
+        self._task = None
+
+    async def _run(self):
+        async with httpx.AsyncClient(timeout=PING_TIMEOUT, follow_redirects=True) as client:
+            while True:
+                started = time.monotonic()
+                try:
+                    response = await client.get(self.url)
+                    self.last_latency = time.monotonic() - started
+                    self.last_status = response.status_code
+                    self.failures = 0
+                    delay = self.interval
+                    logger.info(f"✅ پاسخ پینگ: {response.status_code} ({self.last_latency * 1000:.0f}ms)")
+                except httpx.HTTPError as e:
+                    self.failures += 1
+                    delay = min(self.interval, PING_BACKOFF_BASE * 2 ** (self.failures - 1))
+                    logger.error(f"❌ خطا در ارسال پینگ: {e}")
+                self.total += 1
+                await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"📡 فعال‌سازی سیستم بیدار ماندن ربات ({self.url})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None